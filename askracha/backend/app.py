@@ -1,13 +1,15 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from rag import AskRachaRAG
 from document_scheduler import DocumentUpdateScheduler
 from chat_context import ChatContextManager
-from rate_limit.rate_limit_middleware import create_rate_limit_middleware
+from rate_limit.rate_limit_middleware import create_rate_limit_middleware, get_rate_limit_result
 import os
 import sys
+import atexit
+import json
+import threading
 from datetime import datetime
-from llama_index.core import VectorStoreIndex
 
 app = Flask(__name__)
 
@@ -24,12 +26,32 @@ rate_limit_middleware = create_rate_limit_middleware(app)
 # Global RAG instance
 rag = None
 
+# Stop the RAG background loop and worker pools on interpreter exit
+atexit.register(lambda: rag and rag.close())
+
 # Global scheduler instance
 document_scheduler = None
 
 # Global context manager instance
 context_manager = ChatContextManager()
 
+# Seconds to wait before closing a replaced RAG instance, so requests that
+# already picked it up can finish on its loop and worker pools
+_RAG_CLOSE_GRACE_SECONDS = 60.0
+
+
+def _replace_rag(new_rag):
+    """Swap the global RAG instance and close the old one once in-flight requests drain"""
+    global rag
+    old_rag, rag = rag, new_rag
+    if document_scheduler is not None:
+        document_scheduler.set_rag_instance(new_rag)
+    if old_rag is not None and old_rag is not new_rag:
+        closer = threading.Timer(_RAG_CLOSE_GRACE_SECONDS, old_rag.close)
+        closer.daemon = True
+        closer.start()
+
+
 # Knowledge base loading status
 kb_loading_status = {
     "status": "not_started",  # not_started, loading, ready, error
@@ -49,7 +71,7 @@ def load_default_documents():
     
     if not rag:
         try:
-            rag = AskRachaRAG()
+            _replace_rag(AskRachaRAG())
             kb_loading_status["progress"] = 20
             kb_loading_status["message"] = "RAG system initialized"
         except Exception as e:
@@ -102,24 +124,10 @@ def load_default_documents():
         result = rag.load_documents(default_urls)
         
         if result["success"]:
-            kb_loading_status["progress"] = 80
-            kb_loading_status["message"] = "Building search index..."
-            
-            print(f"🧠 Creating comprehensive index from {len(rag.documents)} documents...")
-            rag.index = VectorStoreIndex.from_documents(
-                rag.documents,
-                show_progress=True
-            )
-            
-            rag.query_engine = rag.index.as_query_engine(
-                similarity_top_k=6,
-                response_mode="tree_summarize",
-                verbose=True
-            )
-            
+            # Newly loaded documents were added to the index while loading
             kb_loading_status["progress"] = 90
             kb_loading_status["message"] = "Starting document scheduler..."
-            kb_loading_status["documents_loaded"] = len(rag.documents)
+            kb_loading_status["documents_loaded"] = len(rag.document_manifest)
             
             print(f"Successfully loaded default documents")
             print(rag.get_status())
@@ -159,7 +167,7 @@ def test_connection():
     
     if not rag:
         try:
-            rag = AskRachaRAG()
+            _replace_rag(AskRachaRAG())
         except Exception as e:
             return jsonify({
                 'success': False,
@@ -178,7 +186,7 @@ def initialize_rag():
     global rag
     try:
         print("🚀 Initializing AskRacha RAG system...")
-        rag = AskRachaRAG()
+        _replace_rag(AskRachaRAG())
 
         # Test the connection
         test_result = rag.test_connection()
@@ -294,24 +302,22 @@ def query_documents():
         }), 400
     
     try:
-        result = rag.query(query)
+        result = rag.query(query, data.get('filters'))
         if result['success']:
             print(f"✅ Query processed successfully")
-            # Add rate limit info to successful responses
-            response = jsonify(result)
-            
             # Add helpful rate limit information for users
-            from flask import g
-            if hasattr(g, 'rate_limit_result') and g.rate_limit_result:
-                reset_time = g.rate_limit_result.reset_time
-                response.headers['X-Next-Request-Available'] = reset_time.isoformat()
-                
+            rate_limit_result = get_rate_limit_result()
+            if rate_limit_result:
                 # Add user-friendly message about when they can ask again
                 result['rate_limit_info'] = {
-                    'next_request_available': reset_time.isoformat(),
-                    'message': f'You can ask your next question after {reset_time.strftime("%H:%M:%S")}'
+                    'next_request_available': rate_limit_result.reset_iso,
+                    'message': f'You can ask your next question after {rate_limit_result.reset_time.strftime("%H:%M:%S")}'
                 }
-                response = jsonify(result)
+            
+            # Add rate limit info to successful responses
+            response = jsonify(result)
+            if rate_limit_result:
+                response.headers['X-Next-Request-Available'] = rate_limit_result.reset_iso
             
             return response
         else:
@@ -330,6 +336,36 @@ def query_documents():
             'type': 'system_error'
         }), 500
 
+@app.route('/api/query/stream', methods=['POST'])
+def stream_query_documents():
+    """Query endpoint without context that streams the answer as server-sent events"""
+    global rag
+    
+    if not rag:
+        return jsonify({
+            'success': False,
+            'message': 'RAG system not initialized'
+        }), 400
+    
+    data = request.json
+    query = data.get('question')
+    
+    if not query:
+        return jsonify({
+            'success': False,
+            'message': 'No question provided'
+        }), 400
+    
+    def generate():
+        for event in rag.query_stream(query):
+            yield f"data: {json.dumps(event)}\n\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/status', methods=['GET'])
 def get_status():
     """Get RAG system status"""
@@ -356,7 +392,9 @@ def reset_system():
     """Reset the RAG system"""
     global rag
     try:
-        rag = None
+        # Drop the instance first; its loop thread and worker pools are
+        # stopped after in-flight requests have had time to finish
+        _replace_rag(None)
         return jsonify({
             'success': True,
             'message': 'RAG system reset successfully'
@@ -372,7 +410,7 @@ def list_documents():
     """List loaded documents"""
     global rag
     
-    if not rag or not rag.documents:
+    if not rag or not rag.document_manifest:
         return jsonify({
             'documents': [],
             'count': 0
@@ -380,13 +418,13 @@ def list_documents():
     
     try:
         documents_info = []
-        for doc in rag.documents:
+        for entry in rag.document_manifest.values():
             doc_info = {
-                'source': doc.metadata.get('source', 'Unknown'),
-                'title': doc.metadata.get('title', 'Untitled'),
-                'length': doc.metadata.get('length', 0),
-                'type': doc.metadata.get('type', 'unknown'),
-                'preview': doc.text[:200] + "..." if len(doc.text) > 200 else doc.text
+                'source': entry['source'],
+                'title': entry['title'],
+                'length': entry['length'],
+                'type': entry['type'],
+                'preview': entry['preview'] + "..." if entry['length'] > 200 else entry['preview']
             }
             documents_info.append(doc_info)
         
@@ -0,0 +1,83 @@
+import re
+from typing import Optional, Tuple
+import soupsieve
+from bs4 import BeautifulSoup
+
+# Main content areas to try, in order of preference
+MAIN_SELECTORS = (
+    'main',
+    'article',
+    '[role="main"]',
+    '.content',
+    '.main-content',
+    '.post-content',
+    '.entry-content',
+    '#content',
+    '#main',
+)
+
+# Selectors compiled once rather than re-parsed by select_one on every page
+_COMPILED_MAIN_SELECTORS = tuple(soupsieve.compile(selector) for selector in MAIN_SELECTORS)
+
+# Lines starting with these are bare links rather than documentation text
+URL_PREFIXES = ('http://', 'https://', 'ftp://')
+
+# A content line: captures the stripped text when it is longer than 3 chars and
+# doesn't start with one of URL_PREFIXES
+_CONTENT_LINE_PATTERN = re.compile(
+    r'^[^\S\n]*(?!(?:https?|ftp)://)(\S[^\n]{2,}\S)[^\S\n]*$',
+    re.MULTILINE
+)
+
+# Maximum number of characters kept per page
+MAX_CONTENT_CHARS = 15000
+
+# Maximum length of a page title
+MAX_TITLE_CHARS = 100
+
+
+def _parse_html(raw: bytes) -> BeautifulSoup:
+    """Parse with the C-backed lxml parser, falling back to the pure-Python one"""
+    try:
+        return BeautifulSoup(raw, 'lxml')
+    except Exception as e:
+        print(f"⚠️ lxml could not parse page, falling back to html.parser: {e}")
+        return BeautifulSoup(raw, 'html.parser')
+
+
+def extract_page(raw: bytes) -> Tuple[str, Optional[str]]:
+    """Extract cleaned main-content text and the page title from raw HTML.
+
+    The title is the main content's first <h1>, else the document <title>, or
+    None if neither has text. Kept as a module-level function with no heavy
+    imports so it can run in a process pool worker.
+    """
+    soup = _parse_html(raw)
+    document_title = soup.title.get_text(strip=True) if soup.title else ''
+
+    # Remove unwanted elements
+    for element in soup(['script', 'style', 'nav', 'footer', 'header', 'aside', 'iframe']):
+        element.decompose()
+
+    # Try to find main content areas
+    main_content = None
+    for selector in _COMPILED_MAIN_SELECTORS:
+        main_content = selector.select_one(soup)
+        if main_content:
+            break
+
+    # Fallback to body if no main content found
+    if not main_content:
+        main_content = soup.body or soup
+
+    heading = main_content.find('h1')
+    title = (heading.get_text(' ', strip=True) if heading else '') or document_title
+
+    # Extract text with better formatting
+    text = main_content.get_text(separator='\n', strip=True)
+
+    # Keep stripped lines longer than 3 chars that aren't bare URLs, in one regex pass
+    cleaned_text = '\n'.join(_CONTENT_LINE_PATTERN.findall(text))
+
+    # Limit size but keep reasonable length
+    return cleaned_text[:MAX_CONTENT_CHARS], title[:MAX_TITLE_CHARS] or None
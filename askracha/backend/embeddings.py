@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import weakref
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.embeddings.gemini import GeminiEmbedding
+
+from storage.embedding_cache import EmbeddingCache
+
+
+class BoundedGeminiEmbedding(GeminiEmbedding):
+    """GeminiEmbedding that caps how many async batch requests are in flight at once,
+    so concurrent index builds stay within the Gemini rate limit, and keeps an LRU
+    cache of query embeddings (backed by an optional on-disk cache that survives
+    restarts) so repeated questions skip the embedding call. Chunk embeddings are
+    kept in the on-disk cache too, so rebuilding an index only embeds new text."""
+
+    _max_concurrency: int = PrivateAttr()
+    _semaphores: "weakref.WeakKeyDictionary" = PrivateAttr()
+    _query_cache_size: int = PrivateAttr()
+    _query_cache: "OrderedDict[str, List[float]]" = PrivateAttr()
+    _query_lock: threading.Lock = PrivateAttr()
+    _disk_cache: Optional[EmbeddingCache] = PrivateAttr()
+
+    def __init__(self, max_concurrency: int = 4, query_cache_size: int = 2048,
+                 disk_cache: Optional[EmbeddingCache] = None, **kwargs):
+        super().__init__(**kwargs)
+        self._max_concurrency = max_concurrency
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._query_cache_size = query_cache_size
+        self._query_cache = OrderedDict()
+        self._query_lock = threading.Lock()
+        self._disk_cache = disk_cache
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        """Get the semaphore for the running loop (asyncio primitives are bound to one loop)"""
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self._max_concurrency)
+        return semaphore
+
+    def _cached_query_embedding(self, query: str) -> Optional[List[float]]:
+        with self._query_lock:
+            embedding = self._query_cache.get(query)
+            if embedding is not None:
+                self._query_cache.move_to_end(query)
+                return embedding
+
+        if self._disk_cache is not None:
+            embedding = self._disk_cache.get(EmbeddingCache.key(self.model_name, query))
+            if embedding is not None:
+                self._remember_query_embedding(query, embedding)
+        return embedding
+
+    def _remember_query_embedding(self, query: str, embedding: List[float]):
+        with self._query_lock:
+            self._query_cache[query] = embedding
+            self._query_cache.move_to_end(query)
+            while len(self._query_cache) > self._query_cache_size:
+                self._query_cache.popitem(last=False)
+
+    def _cache_query_embedding(self, query: str, embedding: List[float]):
+        self._remember_query_embedding(query, embedding)
+        if self._disk_cache is not None:
+            self._disk_cache.put(EmbeddingCache.key(self.model_name, query), embedding)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        embedding = self._cached_query_embedding(query)
+        if embedding is None:
+            embedding = super()._get_query_embedding(query)
+            self._cache_query_embedding(query, embedding)
+        return embedding
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        embedding = self._cached_query_embedding(query)
+        if embedding is None:
+            embedding = await super()._aget_query_embedding(query)
+            self._cache_query_embedding(query, embedding)
+        return embedding
+
+    def _cached_text_embeddings(self, texts: List[str]) -> Tuple[List[Optional[List[float]]], List[int]]:
+        """Look texts up in the disk cache; return the embeddings found and the indexes still missing"""
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        if self._disk_cache is None:
+            return embeddings, list(range(len(texts)))
+
+        missing = []
+        for i, text in enumerate(texts):
+            embeddings[i] = self._disk_cache.get(self._text_cache_key(text))
+            if embeddings[i] is None:
+                missing.append(i)
+        return embeddings, missing
+
+    def _fill_text_embeddings(self, texts: List[str], embeddings: List[Optional[List[float]]],
+                              missing: List[int], fresh: List[List[float]]):
+        for i, embedding in zip(missing, fresh):
+            embeddings[i] = embedding
+            if self._disk_cache is not None:
+                self._disk_cache.put(self._text_cache_key(texts[i]), embedding)
+
+    def _text_cache_key(self, text: str) -> str:
+        # Same key as PineconeVectorStore's document embeddings, so both reuse each other's
+        return EmbeddingCache.key(f"{self.model_name}:document", text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        embeddings, missing = self._cached_text_embeddings(texts)
+        if missing:
+            fresh = super()._get_text_embeddings([texts[i] for i in missing])
+            self._fill_text_embeddings(texts, embeddings, missing, fresh)
+        return embeddings
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        embeddings, missing = self._cached_text_embeddings(texts)
+        if missing:
+            async with self._semaphore():
+                fresh = await super()._aget_text_embeddings([texts[i] for i in missing])
+            self._fill_text_embeddings(texts, embeddings, missing, fresh)
+        return embeddings
@@ -0,0 +1,151 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Hashable
+
+import numpy as np
+
+
+def normalize_question(question: str) -> str:
+    """Normalize case and whitespace so trivially different questions share a cache key"""
+    return " ".join(question.lower().split())
+
+
+class QueryCache:
+    """Two-tier answer cache: exact match on the normalized question, then
+    semantic match on the question embedding (cosine similarity).
+
+    Changes are written to disk at most once per flush_interval seconds, off the
+    request path, and on close()."""
+
+    def __init__(self, path: str, max_entries: int = 500, similarity_threshold: float = 0.95,
+                 flush_interval: float = 30.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        # Serializes file writes, which happen outside _lock
+        self._write_lock = threading.Lock()
+        self._dirty = False
+        # Bumped by clear(), so a snapshot taken before it is never written after it
+        self._generation = 0
+        self._flush_timer: Optional[threading.Timer] = None
+        self._exact: "OrderedDict[Hashable, Dict]" = OrderedDict()
+        # Unit-normalized question embeddings, one row per cached answer
+        self._embeddings: Optional[np.ndarray] = None
+        self._answers: List[Dict] = []
+
+        self._load()
+
+    def get_exact(self, key: Hashable) -> Optional[Dict]:
+        """Return the cached result for an exact key, if any"""
+        with self._lock:
+            result = self._exact.get(key)
+            if result is None:
+                return None
+            self._exact.move_to_end(key)
+            return dict(result)
+
+    def get_similar(self, embedding: List[float]) -> Optional[Dict]:
+        """Return the cached result for the most similar past question above the threshold"""
+        with self._lock:
+            if self._embeddings is None or not len(self._answers):
+                return None
+
+            query = self._unit(embedding)
+            similarities = self._embeddings @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                return None
+            return dict(self._answers[best])
+
+    def put(self, key: Hashable, result: Dict, embedding: Optional[List[float]] = None):
+        """Cache a result under an exact key and, optionally, its question embedding"""
+        with self._lock:
+            self._exact[key] = dict(result)
+            self._exact.move_to_end(key)
+            while len(self._exact) > self.max_entries:
+                self._exact.popitem(last=False)
+
+            if embedding is not None:
+                row = self._unit(embedding)[np.newaxis, :]
+                if self._embeddings is None:
+                    self._embeddings = row
+                else:
+                    self._embeddings = np.vstack([self._embeddings, row])[-self.max_entries:]
+                self._answers = (self._answers + [dict(result)])[-self.max_entries:]
+
+            self._mark_dirty()
+
+    def clear(self):
+        """Drop all cached answers (e.g. after the knowledge base changes)"""
+        with self._lock:
+            self._exact.clear()
+            self._embeddings = None
+            self._answers = []
+            self._generation += 1
+            self._mark_dirty()
+
+    def flush(self):
+        """Write the cache to disk if it changed since the last write"""
+        with self._lock:
+            self._flush_timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+            # Entries are never mutated in place, so shallow copies are a consistent snapshot
+            snapshot = (OrderedDict(self._exact), self._embeddings, list(self._answers))
+            generation = self._generation
+        self._save(snapshot, generation)
+
+    def close(self):
+        """Cancel the pending flush and write any unsaved changes"""
+        with self._lock:
+            timer = self._flush_timer
+        if timer is not None:
+            timer.cancel()
+        self.flush()
+
+    def _mark_dirty(self):
+        """Schedule a flush for a change (called with the lock held)"""
+        self._dirty = True
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _save(self, snapshot, generation: int):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            tmp_path = f"{self.path}.tmp"
+            with self._write_lock:
+                # Cleared since the snapshot; the flush clear() scheduled writes the newer state
+                with self._lock:
+                    if generation != self._generation:
+                        return
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(snapshot, f)
+                os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Warning: Could not save query cache: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                self._exact, self._embeddings, self._answers = pickle.load(f)
+            print(f"Loaded {len(self._exact)} cached answers from {self.path}")
+        except Exception as e:
+            print(f"Warning: Could not load query cache: {e}")
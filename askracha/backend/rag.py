@@ -1,32 +1,211 @@
 import os
 import asyncio
-from typing import List, Dict
+import io
+import hashlib
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Iterator, List, Dict, Optional, Tuple
 from urllib.parse import urljoin, urlparse
 from dotenv import load_dotenv
+import orjson
+import numpy as np
 
 from google import genai
+from google.genai import types
 
 # Latest LlamaIndex imports
 from llama_index.core import (
     VectorStoreIndex,
     Document,
     Settings,
-    StorageContext
+    StorageContext,
+    PromptTemplate
 )
 
 from llama_index.core.indices.loading import load_index_from_storage
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.response_synthesizers import get_response_synthesizer
+from llama_index.core.schema import QueryBundle
 from llama_index.llms.gemini import Gemini
-from llama_index.embeddings.gemini import GeminiEmbedding
-from llama_index.readers.web import SimpleWebPageReader, SitemapReader
+from llama_index.readers.web import SimpleWebPageReader
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import lxml.etree
 
 from storage.pinecone_vector_store import PineconeVectorStore
+from storage.page_cache import PageCache
+from storage.embedding_cache import EmbeddingCache
 from cleaning.processors import RepoProcessor
+from cleaning.page_parser import extract_page
+from query_cache import QueryCache, normalize_question
+from retrieval import QuantizedEmbeddings, QuantizedVectorRetriever
+from embeddings import BoundedGeminiEmbedding
 
 load_dotenv()
 
+# Upper bound on bytes read from a scraped page (Storacha docs are well under this)
+_MAX_RESPONSE_BYTES = 2_000_000
+
+# Content types worth parsing; PDFs, images and other binaries are skipped unread
+_HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+
+# Request headers used for scraping documentation pages
+_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'br, gzip, deflate',
+    'Connection': 'keep-alive',
+}
+
+# Texts per Gemini embedding request (Gemini accepts up to 100 per batch);
+# lower it to fit a deployment's rate-limit budget
+_EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+
+# Nodes embedded and inserted per batch when building an index
+_INSERT_BATCH_SIZE = 512
+
+# Chunking for indexed pages (tokens); set per instance rather than on the global Settings
+_CHUNK_SIZE = 1024
+_CHUNK_OVERLAP = 20
+
+# Embedding batch requests in flight at once during async index builds
+_EMBED_CONCURRENCY = 4
+
+# Keywords that mark a link as documentation
+_DOC_KEYWORDS = (
+    'docs', 'guide', 'tutorial', 'help', 'api', 'reference', 'quickstart',
+    'getting-started', 'concept', 'how-to', 'overview', 'intro', 'setup',
+    'install', 'config', 'examples', 'learn', 'manual', 'handbook',
+)
+
+# All keywords as one escaped alternation, so each URL is checked in a single regex scan
+_DOC_URL_PATTERN = re.compile('|'.join(map(re.escape, _DOC_KEYWORDS)), re.IGNORECASE)
+
+# Number of chunks retrieved per query
+_SIMILARITY_TOP_K = 8
+
+# Worker count for concurrent page fetches (network-bound)
+_FETCH_WORKERS = 32
+
+# "compact" packs the retrieved chunks into as few LLM calls as fit (usually one);
+# set RESPONSE_MODE=tree_summarize for long-context syntheses
+_RESPONSE_MODE = os.getenv("RESPONSE_MODE", "compact")
+
+# Static answering instructions, kept in the synthesizer template instead of
+# being prepended to every question
+_QA_TEMPLATE = PromptTemplate(
+    "You are an expert assistant for the loaded documentation.\n"
+    "Documentation:\n"
+    "---------------------\n"
+    "{context_str}\n"
+    "---------------------\n"
+    "Answer accurately from the documentation, with specific details and examples where available. "
+    "If it does not fully answer the question, say so.\n"
+    "Question: {query_str}\n"
+    "Answer: "
+)
+
+# Used when retrieved context overflows one prompt and the answer is refined chunk by chunk
+_REFINE_TEMPLATE = PromptTemplate(
+    "Question: {query_str}\n"
+    "Current answer: {existing_answer}\n"
+    "More documentation:\n"
+    "---------------------\n"
+    "{context_msg}\n"
+    "---------------------\n"
+    "Improve the answer with this documentation if it helps; otherwise repeat the current answer.\n"
+    "Answer: "
+)
+
+# Conversation turns included when answering with context
+_CONTEXT_TURNS = 4
+
+# Static instructions for query_with_context, sent as the system instruction so every
+# request shares an identical prefix that Gemini can serve from its prompt cache
+_CONTEXT_INSTRUCTION = (
+    "You are an expert assistant for the loaded documentation. "
+    "Answer from the documentation, consistently with the conversation, simply for basic questions "
+    "and in technical detail only when needed. If the documentation does not answer it, say so.\n"
+    "Set show_sources to true only if the answer uses technical information from the documentation."
+)
+
+_CONTEXT_PROMPT = (
+    "Documentation:\n"
+    "---------------------\n"
+    "{documentation}\n"
+    "---------------------\n"
+    "Previous conversation:\n"
+    "{conversation}\n\n"
+    "Current question: {question}"
+)
+
+# Structured output schema for query_with_context, decoded by Gemini directly
+_CONTEXT_CONFIG = types.GenerateContentConfig(
+    system_instruction=_CONTEXT_INSTRUCTION,
+    temperature=0.1,
+    response_mime_type='application/json',
+    response_schema={
+        'type': 'OBJECT',
+        'properties': {
+            'show_sources': {'type': 'BOOLEAN'},
+            'response': {'type': 'STRING'}
+        },
+        'required': ['show_sources', 'response']
+    }
+)
+
+# Seconds an answer in the shared Pinecone answer cache stays valid
+_QA_CACHE_TTL = int(os.getenv("QA_CACHE_TTL", str(7 * 24 * 3600)))
+
+# Whole storage context (docstore, index store, vector store) serialized as one orjson file
+_INDEX_DIR = "persistent_index"
+_INDEX_FILE = os.path.join(_INDEX_DIR, "storage.json")
+# int8 embeddings of the index's nodes, which the storage file holds no floats for
+_QUANTIZED_FILE = os.path.join(_INDEX_DIR, "embeddings.q8.npz")
+
+
+# Metadata keys a query may be pre-filtered on
+_FILTER_KEYS = ('domain', 'path_prefix')
+
+# Bookkeeping metadata kept out of embeddings and prompts
+_HIDDEN_METADATA_KEYS = ('text_hash', *_FILTER_KEYS)
+
+
+def _url_metadata(url: str) -> Dict[str, str]:
+    """Domain and first path segment of a page URL, used to pre-filter retrieval"""
+    parsed = urlparse(url)
+    return {
+        'domain': parsed.netloc,
+        'path_prefix': parsed.path.strip('/').split('/', 1)[0]
+    }
+
+
+def _text_hash(text: str) -> str:
+    """Fast content hash used to spot pages mirrored under several URLs"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class _HrefCollector:
+    """lxml parser target that keeps only anchor hrefs, so no document tree is built"""
+
+    def __init__(self):
+        self.hrefs: List[str] = []
+
+    def start(self, tag, attrib):
+        if tag == 'a':
+            href = attrib.get('href')
+            if href:
+                self.hrefs.append(href)
+
+    def close(self) -> List[str]:
+        return self.hrefs
+
 
 class AskRachaRAG:
     def __init__(self):
@@ -46,20 +225,93 @@ class AskRachaRAG:
             temperature=0.1
         )
 
-        Settings.embed_model = GeminiEmbedding(
+        # Shared by query embeddings and the vector store's document embeddings
+        self._embedding_cache = embedding_cache = EmbeddingCache(os.path.join(_INDEX_DIR, "embeddings.sqlite3"))
+        Settings.embed_model = BoundedGeminiEmbedding(
             model_name="models/text-embedding-004",  # Latest embedding model
-            api_key=self.gemini_api_key
+            api_key=self.gemini_api_key,
+            embed_batch_size=_EMBED_BATCH_SIZE,
+            max_concurrency=_EMBED_CONCURRENCY,
+            disk_cache=embedding_cache
         )
 
-        self.vector_store = PineconeVectorStore()
+        # Open the Gemini connections in the background so the first query doesn't pay for it
+        threading.Thread(target=self._warm, daemon=True).start()
+
+        self.vector_store = PineconeVectorStore(embedding_cache=embedding_cache)
 
         self.index = None
         self.query_engine = None
-        self.documents = []
+        self.streaming_query_engine = None
+        self._retriever: Optional[QuantizedVectorRetriever] = None
+        self._quantized = QuantizedEmbeddings()
+        self._splitter = SentenceSplitter(chunk_size=_CHUNK_SIZE, chunk_overlap=_CHUNK_OVERLAP)
+
+        # Built once and shared by every query engine; only the retriever depends on the index
+        self._response_synthesizer = get_response_synthesizer(
+            response_mode=_RESPONSE_MODE,
+            text_qa_template=_QA_TEMPLATE,
+            refine_template=_REFINE_TEMPLATE,
+            summary_template=_QA_TEMPLATE
+        )
+        self._streaming_response_synthesizer = get_response_synthesizer(
+            response_mode=_RESPONSE_MODE,
+            text_qa_template=_QA_TEMPLATE,
+            refine_template=_REFINE_TEMPLATE,
+            summary_template=_QA_TEMPLATE,
+            streaming=True
+        )
+        # One lightweight entry per stored page, keyed by source URL; also rebuilt from
+        # the docstore when the persisted index is loaded, so counts and dedup survive restarts
+        self.document_manifest: Dict[str, Dict] = {}
+        # Running total of the manifest's page lengths, so status is O(1)
+        self._total_chars = 0
+        # Hash of the manifest's page versions; shared cached answers are only reused
+        # by processes holding the same corpus
+        self._corpus_version = ''
         self.documents_already_embedded = False  # Flag to track if docs have embeddings
 
+        # Long-lived event loop for sync callers; avoids spinning up a new loop per call
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._loop_thread.start()
+
+        # Shared HTTP session so concurrent fetches reuse TCP/TLS connections;
+        # transient failures (429 / 5xx, connection errors) are retried with backoff
+        self._session = requests.Session()
+        self._session.headers.update(_HEADERS)
+        retries = Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=_FETCH_WORKERS, pool_maxsize=_FETCH_WORKERS, max_retries=retries)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+        # Scraped page text cached on disk; revalidated with ETag / Last-Modified
+        self.page_cache = PageCache()
+
+        # Thread pool for page fetches and process pool for CPU-bound HTML parsing,
+        # both created on first use and reused by every batch
+        self._fetch_pool: Optional[ThreadPoolExecutor] = None
+        self._parse_pool: Optional[ProcessPoolExecutor] = None
+
+        # Exact + semantic answer cache, invalidated whenever documents are added
+        self.query_cache = QueryCache(os.path.join(_INDEX_DIR, "qcache.pkl"))
+
         self._initialize_vector_store()
 
+    def _warm(self):
+        """Issue one tiny embedding and LLM call to establish connections and auth"""
+        try:
+            Settings.embed_model.get_query_embedding("ping")
+            Settings.llm.complete("ping")
+            print("🔥 Gemini connections warmed up")
+        except Exception as e:
+            print(f"Warning: Could not warm up Gemini connections: {e}")
+
     def _initialize_vector_store(self):
         """Initialize the vector store and load existing documents if any"""
         try:
@@ -75,6 +327,12 @@ class AskRachaRAG:
                 print(
                     f"Found {stats['stats'].points_count} existing documents in vector store"
                 )
+                # The persisted docstore + index already hold the text and embeddings,
+                # so only fall back to rebuilding from the vector store when it's missing
+                if self._load_persistent_index():
+                    print("Persistent index loaded successfully (no document reload or embedding regeneration)")
+                    self._restore_manifest()
+                    return
                 self._load_existing_documents()
         except Exception as e:
             print(f"Warning: Error initializing vector store: {e}")
@@ -92,7 +350,11 @@ class AskRachaRAG:
                 if not result["success"]:
                     raise Exception(f"Failed to store repo documents: {result['message']}")
                 
-                self.documents += repo_docs
+                # Updated repo files replace their previous version in the index
+                replaced_ref_doc_ids = self._replaced_ref_doc_ids(repo_docs)
+                self._add_documents(repo_docs)
+                self._index_documents(repo_docs, replaced_ref_doc_ids)
+                self._clear_answer_caches()
                     
                 print("Successfully processed and stored GitHub repo documents")
             else:
@@ -101,58 +363,118 @@ class AskRachaRAG:
         except Exception as e:
             print(f"Error processing GitHub repos: {e}")
 
+    def _add_documents(self, documents: List[Document]):
+        """Record newly stored documents in the manifest (the index keeps their text)"""
+        for doc in documents:
+            self._record_in_manifest(doc.metadata, doc.text, doc.doc_id)
+        self._update_corpus_version()
+
+    def _update_corpus_version(self):
+        """Recompute the corpus version from every page's source and content hash"""
+        digest = hashlib.blake2b(digest_size=16)
+        for source in sorted(self.document_manifest):
+            entry = self.document_manifest[source]
+            digest.update(f"{source}\0{entry['text_hash']}\0{entry['length']}\n".encode('utf-8'))
+        self._corpus_version = digest.hexdigest()
+
+    def _replaced_ref_doc_ids(self, documents: List[Document]) -> List[str]:
+        """Index ids of the versions of these pages already in the manifest"""
+        return [
+            entry['ref_doc_id'] for entry in
+            (self.document_manifest.get(doc.metadata.get('source')) for doc in documents)
+            if entry and entry['ref_doc_id']
+        ]
+
+    def _record_in_manifest(self, metadata: Dict, text: str, ref_doc_id: Optional[str] = None):
+        """Add or replace a page's manifest entry, keeping the character total current"""
+        source = metadata.get('source', 'Unknown')
+        length = metadata.get('length') or len(text)
+        previous = self.document_manifest.get(source)
+        if previous:
+            self._total_chars -= previous['length']
+        self.document_manifest[source] = {
+            'source': source,
+            'title': metadata.get('title', 'Untitled'),
+            'type': metadata.get('type', 'unknown'),
+            'length': length,
+            'text_hash': metadata.get('text_hash'),
+            'preview': text[:200],
+            'ref_doc_id': ref_doc_id
+        }
+        self._total_chars += length
+
+    def _restore_manifest(self):
+        """Rebuild the manifest from the loaded index's docstore, one entry per page"""
+        self.document_manifest = {}
+        self._total_chars = 0
+        for node in self.index.docstore.docs.values():
+            source = node.metadata.get('source')
+            # Chunks are stored in order, so a page's first chunk comes first
+            if source and source not in self.document_manifest:
+                self._record_in_manifest(node.metadata, node.get_content(), node.ref_doc_id)
+        self._update_corpus_version()
+        print(f"Restored manifest of {len(self.document_manifest)} documents")
+
     def _load_existing_documents(self):
-        """Load existing documents from vector store into memory and load existing index"""
+        """Load existing documents from the vector store and index them"""
         try:
             print("Loading existing documents from vector store...")
-            
-            # Use Pinecone's get_all_vectors method
-            all_vectors = self.vector_store.get_all_vectors(limit=1000)
-            
-            if all_vectors:
-                print(f"Found {len(all_vectors)} vectors in Pinecone")
 
-                for vector_data in all_vectors:
-                    metadata = vector_data.get('metadata', {})
-                    text = metadata.get('text', '')
-                    
-                    doc_metadata = {}
-                    if 'source' in metadata:
-                        doc_metadata['source'] = metadata['source']
-                    if 'title' in metadata:
-                        doc_metadata['title'] = metadata['title']
-                    if 'type' in metadata:
-                        doc_metadata['type'] = metadata['type']
-                    if 'length' in metadata:
-                        doc_metadata['length'] = metadata['length']
-                    
-                    doc = Document(text=text, metadata=doc_metadata)
-                    self.documents.append(doc)
-                
-                print(f"Loaded {len(self.documents)} documents into memory")
-                
-                if self.documents:
-                    self._create_lightweight_index()
+            # Pinecone holds one vector per whole page, which doesn't match the chunks the
+            # index retrieves, so pages are re-chunked; chunk embeddings computed before
+            # come from the embedding cache rather than another Gemini call
+            documents = []
+
+            # Stream vectors page by page rather than one capped query
+            for vector_data in self.vector_store.iter_vectors():
+                metadata = vector_data.get('metadata', {})
+                text = metadata.get('text', '')
+
+                doc_metadata = {}
+                if 'source' in metadata:
+                    doc_metadata['source'] = metadata['source']
+                if 'title' in metadata:
+                    doc_metadata['title'] = metadata['title']
+                if 'type' in metadata:
+                    doc_metadata['type'] = metadata['type']
+                if 'length' in metadata:
+                    doc_metadata['length'] = metadata['length']
+                # Lets reloads skip pages whose content is already stored
+                if 'text_hash' in metadata:
+                    doc_metadata['text_hash'] = metadata['text_hash']
+                if 'source' in metadata:
+                    doc_metadata.update(_url_metadata(metadata['source']))
+
+                documents.append(Document(
+                    text=text,
+                    metadata=doc_metadata,
+                    excluded_embed_metadata_keys=list(_HIDDEN_METADATA_KEYS),
+                    excluded_llm_metadata_keys=list(_HIDDEN_METADATA_KEYS)
+                ))
+
+            if documents:
+                self._add_documents(documents)
+                print(f"Loaded {len(documents)} documents from vector store")
+                self._build_index(documents)
             else:
                 print("No documents found in vector store")
-                
+
         except Exception as e:
             print(f"Error loading existing documents: {e}")
 
-    def _build_index(self):
+    def _build_index(self, documents: List[Document]):
         """Build LlamaIndex from loaded documents"""
         try:
-            print(f"Building knowledge index from {len(self.documents)} documents...")
+            print(f"Building knowledge index from {len(documents)} documents...")
             self.index = VectorStoreIndex.from_documents(
-                self.documents,
-                show_progress=True
+                documents,
+                transformations=[self._splitter],
+                show_progress=True,
+                use_async=True,
+                insert_batch_size=_INSERT_BATCH_SIZE
             )
 
-            self.query_engine = self.index.as_query_engine(
-                similarity_top_k=6,
-                response_mode="tree_summarize",
-                verbose=True
-            )
+            self._build_query_engine()
             print("Index and query engine built successfully")
             
             self._save_persistent_index()
@@ -160,71 +482,91 @@ class AskRachaRAG:
         except Exception as e:
             print(f"Error building index: {e}")
     
-    def _create_lightweight_index(self):
-        """Create a lightweight index without regenerating embeddings"""
+    def _index_documents(self, documents: List[Document], replaced_ref_doc_ids: Optional[List[str]] = None):
+        """Add newly loaded documents to the live index, embedding only their chunks (in batched calls)
+
+        replaced_ref_doc_ids are earlier versions of these pages, removed from the index first.
+        """
+        if self.index is None:
+            self._build_index(documents)
+            return
+
         try:
-            print("Creating lightweight index from existing documents...")
-            
-            if self._load_persistent_index():
-                print("Persistent index loaded successfully (no embedding regeneration)")
-                return
-            
-            print("Creating minimal index for existing documents...(might take a minute )")
-            self.index = VectorStoreIndex.from_documents(
-                self.documents,
-                show_progress=False,
-                embed_metadata=False
-            )
-            
-            self.query_engine = self.index.as_query_engine(
-                similarity_top_k=6,
-                response_mode="tree_summarize",
-                verbose=True
-            )
-            
+            for ref_doc_id in replaced_ref_doc_ids or ():
+                self.index.delete_ref_doc(ref_doc_id, delete_from_docstore=True)
+
+            print(f"Indexing {len(documents)} new documents...")
+            nodes = run_transformations(documents, [self._splitter])
+            self.index.insert_nodes(nodes)
+
+            self._build_query_engine()
             self._save_persistent_index()
-            
-            print("Lightweight index created and saved for future use")
-            
+
         except Exception as e:
-            print(f"Error creating lightweight index: {e}")
-            print("Falling back to full index rebuild...")
-            self._build_index()
+            print(f"Error indexing new documents: {e}")
+
+    def _build_query_engine(self):
+        """Build the query engine over the current index, retrieving from int8-quantized embeddings"""
+        # The in-memory vector store is a SimpleVectorStore; its float embeddings are moved into
+        # the int8 rows so only one copy is kept
+        self._quantized.sync(self.index.vector_store.data.embedding_dict)
+        retriever = QuantizedVectorRetriever(self.index, self._quantized, similarity_top_k=_SIMILARITY_TOP_K)
+        self._retriever = retriever
+        self.query_engine = RetrieverQueryEngine(
+            retriever=retriever,
+            response_synthesizer=self._response_synthesizer
+        )
+        self.streaming_query_engine = RetrieverQueryEngine(
+            retriever=retriever,
+            response_synthesizer=self._streaming_response_synthesizer
+        )
 
     def _save_persistent_index(self):
         """Save the current index to disk for future loading"""
         try:
-            index_dir = "persistent_index"
-            if not os.path.exists(index_dir):
-                os.makedirs(index_dir)
-            
-            self.index.storage_context.persist(persist_dir=index_dir)
-            print(f"Index saved to {index_dir}")
+            if not os.path.exists(_INDEX_DIR):
+                os.makedirs(_INDEX_DIR)
+
+            tmp_path = f"{_INDEX_FILE}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(self.index.storage_context.to_dict()))
+            os.replace(tmp_path, _INDEX_FILE)
+            self._quantized.save(_QUANTIZED_FILE)
+            print(f"Index saved to {_INDEX_FILE}")
         except Exception as e:
             print(f"Warning: Could not save persistent index: {e}")
     
     def _load_persistent_index(self):
         """Load existing index from disk if available"""
         try:
-            index_dir = "persistent_index"
-            
-            if not os.path.exists(index_dir):
-                return False
-            
-            if not os.path.exists(os.path.join(index_dir, "docstore.json")):
+            if os.path.exists(_INDEX_FILE):
+                print(f"Loading persistent index from {_INDEX_FILE}...")
+                with open(_INDEX_FILE, 'rb') as f:
+                    storage_context = StorageContext.from_dict(orjson.loads(f.read()))
+            elif os.path.exists(os.path.join(_INDEX_DIR, "docstore.json")):
+                # Index persisted by an older version as separate JSON files
+                print(f"Loading persistent index from {_INDEX_DIR}...")
+                storage_context = StorageContext.from_defaults(persist_dir=_INDEX_DIR)
+            else:
                 return False
-            
-            print(f"Loading persistent index from {index_dir}...")
-            
-            storage_context = StorageContext.from_defaults(persist_dir=index_dir)
+
             self.index = load_index_from_storage(storage_context)
-            
-            self.query_engine = self.index.as_query_engine(
-                similarity_top_k=6,
-                response_mode="tree_summarize",
-                verbose=True
-            )
-            
+
+            if os.path.exists(_QUANTIZED_FILE):
+                self._quantized = QuantizedEmbeddings.load(_QUANTIZED_FILE)
+            embedding_dict = self.index.vector_store.data.embedding_dict
+            # Indexes saved before quantization still hold float embeddings, which sync converts
+            unconverted = any(len(embedding) for embedding in embedding_dict.values())
+            missing = self._quantized.sync(embedding_dict)
+            if missing:
+                print(f"Warning: {missing} indexed chunks have no saved embedding, rebuilding the index")
+                self.index = None
+                return False
+
+            self._build_query_engine()
+            if unconverted:
+                self._save_persistent_index()
+
             return True
             
         except Exception as e:
@@ -232,72 +574,87 @@ class AskRachaRAG:
             return False
 
     def extract_content_title(self, content: str) -> str:
-        """Extract meaningful title from document content"""
-        lines = content.split('\n')[:10]
-        for line in lines:
-            line = line.strip()
-            if 10 <= len(line) <= 100 and not line.startswith('http'):
+        """Extract meaningful title from document content
+
+        Fallback for pages without an <h1> or <title>. Content comes from extract_page, whose lines are already stripped and
+        free of bare URLs, so only the first 10 lines are split off and length-checked.
+        """
+        for line in content.split('\n', 10)[:10]:
+            if 10 <= len(line) <= 100:
                 return line
         return "Documentation Page"
 
-    def scrape_url_advanced(self, url: str) -> str:
-        """Advanced web scraping with BeautifulSoup"""
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-US,en;q=0.5',
-                'Accept-Encoding': 'gzip, deflate',
-                'Connection': 'keep-alive',
+    def _create_page_document(self, url: str, content: str, title: Optional[str] = None) -> Document:
+        """Wrap scraped page content in a Document with standard metadata"""
+        doc = Document(
+            text=content,
+            metadata={
+                'source': url,
+                'title': title or self.extract_content_title(content),
+                'length': len(content),
+                'type': 'documentation_page',
+                'text_hash': _text_hash(content),
+                **_url_metadata(url)
             }
+        )
+        # Hash and filter keys are bookkeeping only; keep them out of embeddings and prompts
+        for key in _HIDDEN_METADATA_KEYS:
+            doc.excluded_embed_metadata_keys.append(key)
+            doc.excluded_llm_metadata_keys.append(key)
+        return doc
+
+    def _get_fetch_pool(self) -> ThreadPoolExecutor:
+        """Get the thread pool used for page fetches (its size bounds fetch concurrency)"""
+        if self._fetch_pool is None:
+            self._fetch_pool = ThreadPoolExecutor(max_workers=_FETCH_WORKERS, thread_name_prefix="fetch")
+        return self._fetch_pool
+
+    def _get_parse_pool(self) -> ProcessPoolExecutor:
+        """Get the process pool used for HTML parsing"""
+        if self._parse_pool is None:
+            self._parse_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+        return self._parse_pool
+
+    def _fetch(self, url: str) -> Dict:
+        """Fetch a page (I/O bound), revalidating any cached copy
+
+        Returns a dict with either 'text' and 'title' (cached page is still current)
+        or 'raw' page bytes plus the 'etag' / 'last_modified' validators to cache.
+        """
+        cached = self.page_cache.get(url)
+        headers = PageCache.conditional_headers(cached) if cached else None
+
+        # Stream the body and cap it so oversized pages don't get fully materialized
+        with self._session.get(url, headers=headers, timeout=20, stream=True) as response:
+            if cached and response.status_code == 304:
+                return {'text': cached['text'], 'title': cached.get('title')}
 
-            response = requests.get(url, headers=headers, timeout=20)
             response.raise_for_status()
 
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            # Remove unwanted elements
-            for element in soup(['script', 'style', 'nav', 'footer', 'header', 'aside', 'iframe']):
-                element.decompose()
-
-            # Try to find main content areas
-            main_selectors = [
-                'main',
-                'article',
-                '[role="main"]',
-                '.content',
-                '.main-content',
-                '.post-content',
-                '.entry-content',
-                '#content',
-                '#main'
-            ]
-
-            main_content = None
-            for selector in main_selectors:
-                main_content = soup.select_one(selector)
-                if main_content:
-                    break
-
-            # Fallback to body if no main content found
-            if not main_content:
-                main_content = soup.body or soup
-
-            # Extract text with better formatting
-            text = main_content.get_text(separator='\n', strip=True)
-
-            # Clean up text
-            lines = []
-            for line in text.split('\n'):
-                line = line.strip()
-                if len(line) > 3 and not line.startswith('http'):  # Filter out URLs and short lines
-                    lines.append(line)
-
-            cleaned_text = '\n'.join(lines)
-
-            # Limit size but keep reasonable length
-            return cleaned_text[:15000]
+            content_type = response.headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+            if content_type and content_type not in _HTML_CONTENT_TYPES:
+                raise ValueError(f"Not an HTML page (Content-Type: {content_type})")
+
+            return {
+                'raw': response.raw.read(_MAX_RESPONSE_BYTES, decode_content=True),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')
+            }
+
+    def scrape_url_advanced(self, url: str) -> str:
+        """Fetch a page (reusing the page cache's text when unchanged) and extract its main content
+
+        Parsing goes through cleaning.page_parser.extract_page (lxml-backed parse, precompiled
+        soupsieve selectors), the same path the bulk loader runs in its process pool.
+        """
+        try:
+            page = self._fetch(url)
+            if 'text' in page:
+                return page['text']
 
+            content, title = extract_page(page['raw'])
+            self.page_cache.put(url, content, page['etag'], page['last_modified'], title)
+            return content
         except Exception as e:
             print(f"Error scraping {url}: {e}")
             return ""
@@ -308,26 +665,26 @@ class AskRachaRAG:
 
         try:
             print(f"🔍 Analyzing page structure for: {base_url}")
-            response = requests.get(base_url, timeout=15)
+            response = self._session.get(base_url, timeout=15)
             response.raise_for_status()
 
-            soup = BeautifulSoup(response.content, 'html.parser')
+            # Collect anchor hrefs while parsing instead of building the whole DOM
+            hrefs = lxml.etree.fromstring(response.content, lxml.etree.HTMLParser(target=_HrefCollector()))
+
+            base_netloc = urlparse(base_url).netloc
 
             # Find all internal links
-            for link in soup.find_all('a', href=True):
-                href = link['href']
+            for href in hrefs:
+                # Same-page anchors and mail links can never be doc pages
+                if href.startswith(('#', 'mailto:')):
+                    continue
+
                 full_url = urljoin(base_url, href)
 
                 # Filter for same domain only
-                if urlparse(full_url).netloc == urlparse(base_url).netloc:
+                if urlparse(full_url).netloc == base_netloc:
                     # Look for documentation-related patterns
-                    url_lower = full_url.lower()
-                    if any(pattern in url_lower for pattern in [
-                        'docs', 'guide', 'tutorial', 'help', 'api', 'reference',
-                        'quickstart', 'getting-started', 'concept', 'how-to',
-                        'overview', 'intro', 'setup', 'install', 'config',
-                        'examples', 'learn', 'manual', 'handbook'
-                    ]):
+                    if _DOC_URL_PATTERN.search(full_url):
                         discovered_urls.add(full_url)
 
             # Limit results to prevent overload
@@ -340,11 +697,35 @@ class AskRachaRAG:
             return [base_url]
 
     def load_comprehensive_documentation(self, urls: List[str]) -> Dict:
+        """Load comprehensive documentation synchronously, running the async loader on the background loop
+
+        Code already running inside an event loop should await
+        load_comprehensive_documentation_async directly instead of blocking on this.
+        """
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            # Blocking the background loop on its own future would deadlock
+            raise RuntimeError("Await load_comprehensive_documentation_async from the background loop")
+
+        future = asyncio.run_coroutine_threadsafe(self.load_comprehensive_documentation_async(urls), self._loop)
+        return future.result()
+
+    async def load_comprehensive_documentation_async(self, urls: List[str]) -> Dict:
         """Load comprehensive documentation using multiple discovery methods"""
+        loop = asyncio.get_running_loop()
         try:
             all_documents = []
             all_loaded_urls = []
             all_failed_urls = []
+            all_skipped_urls = []
+
+            # No URL is fetched twice in one run (sitemaps of different sources overlap).
+            # Pages already in the knowledge base are still fetched: the page cache turns
+            # that into a conditional GET, and unchanged content is dropped by hash below
+            seen_urls = set()
 
             print(
                 f"🔄 Loading comprehensive documentation from {len(urls)} sources...")
@@ -353,45 +734,59 @@ class AskRachaRAG:
                 print(f"📚 Processing documentation source: {base_url}")
 
                 # Method 1: Try structured content discovery
-                structured_urls = self.discover_structured_content(base_url)
+                structured_urls = await self.discover_structured_content(base_url)
 
                 if len(structured_urls) > 1:
                     print(f"✅ Found {len(structured_urls)} structured pages")
-                    documents, loaded, failed = self.process_url_batch(
-                        structured_urls[:50])
+                    batch_urls = self._select_new_urls(structured_urls, seen_urls)
+                    documents, loaded, failed = await self.process_url_batch_async(batch_urls)
                     all_documents.extend(documents)
                     all_loaded_urls.extend(loaded)
                     all_failed_urls.extend(failed)
                 else:
                     # Method 2: Manual URL discovery
                     print("🔍 Using manual discovery method")
-                    discovered_urls = self.discover_documentation_urls(
-                        base_url)
+                    discovered_urls = await loop.run_in_executor(None, self.discover_documentation_urls, base_url)
 
                     if len(discovered_urls) > 1:
-                        documents, loaded, failed = self.process_url_batch(
-                            discovered_urls[:50])
+                        batch_urls = self._select_new_urls(discovered_urls, seen_urls)
+                        documents, loaded, failed = await self.process_url_batch_async(batch_urls)
                         all_documents.extend(documents)
                         all_loaded_urls.extend(loaded)
                         all_failed_urls.extend(failed)
-                    else:
+                    elif base_url not in seen_urls:
                         # Method 3: Single page fallback
                         print("📄 Loading single page")
-                        content = self.scrape_url_advanced(base_url)
-                        if content and len(content) > 200:
-                            doc = Document(
-                                text=content,
-                                metadata={
-                                    'source': base_url,
-                                    'title': self.extract_content_title(content),
-                                    'length': len(content),
-                                    'type': 'documentation_page'
-                                }
-                            )
-                            all_documents.append(doc)
-                            all_loaded_urls.append(base_url)
-                        else:
-                            all_failed_urls.append(base_url)
+                        seen_urls.add(base_url)
+                        documents, loaded, failed = await self.process_url_batch_async([base_url])
+                        all_documents.extend(documents)
+                        all_loaded_urls.extend(loaded)
+                        all_failed_urls.extend(failed)
+
+            # Drop pages whose content is unchanged or was already seen under another URL
+            seen_hashes = {entry['text_hash'] for entry in self.document_manifest.values() if entry['text_hash']}
+            unique_documents = []
+            for doc in all_documents:
+                text_hash = doc.metadata['text_hash']
+                if text_hash in seen_hashes:
+                    print(f"⏭️ Skipping unchanged or duplicate content from: {doc.metadata['source']}")
+                    all_skipped_urls.append(doc.metadata['source'])
+                    continue
+                seen_hashes.add(text_hash)
+                unique_documents.append(doc)
+            all_documents = unique_documents
+
+            if not all_documents and (all_loaded_urls or all_skipped_urls):
+                return {
+                    'success': True,
+                    'message': 'Documentation is already up to date: no new content found',
+                    'loaded_urls': all_loaded_urls,
+                    'failed_urls': all_failed_urls,
+                    'skipped_urls': all_skipped_urls,
+                    'document_count': 0,
+                    'total_chars': 0,
+                    'vector_store_ids': [],
+                }
 
             if not all_documents:
                 return {
@@ -404,7 +799,7 @@ class AskRachaRAG:
             print(
                 f"💾 Storing {len(all_documents)} documents in persistent vector store..."
             )
-            vector_result = self.vector_store.upsert_documents(all_documents)
+            vector_result = await self.vector_store.aupsert_documents(all_documents)
 
             if not vector_result["success"]:
                 return {
@@ -415,13 +810,18 @@ class AskRachaRAG:
                 }
 
 
-            self.documents += all_documents
+            # Changed pages replace their previous version in the index
+            replaced_ref_doc_ids = self._replaced_ref_doc_ids(all_documents)
+            self._add_documents(all_documents)
+            await loop.run_in_executor(None, self._index_documents, all_documents, replaced_ref_doc_ids)
+            self._clear_answer_caches()
 
             return {
                 'success': True,
                 'message': f'Successfully loaded comprehensive documentation: {len(all_documents)} pages',
                 'loaded_urls': all_loaded_urls,
                 'failed_urls': all_failed_urls,
+                'skipped_urls': all_skipped_urls,
                 'document_count': len(all_documents),
                 'total_chars': sum(len(doc.text) for doc in all_documents),
                 "vector_store_ids": vector_result.get("ids", []),
@@ -436,9 +836,35 @@ class AskRachaRAG:
                 'failed_urls': urls
             }
 
-    def discover_structured_content(self, base_url: str) -> List[str]:
-        """Discover structured content using standard web discovery methods"""
-        discovered_urls = []
+    @staticmethod
+    def _select_new_urls(candidate_urls: List[str], seen_urls: set) -> List[str]:
+        """Dedupe candidate URLs (keeping order) against each other and URLs already tried this run,
+        and cap the batch at 50"""
+        batch = [url for url in dict.fromkeys(candidate_urls) if url not in seen_urls][:50]
+        seen_urls.update(batch)
+        return batch
+
+    def _fetch_sitemap(self, sitemap_url: str) -> List[str]:
+        """Fetch a sitemap and stream out its page <loc> entries without building a DOM"""
+        print(f"🔍 Checking structured content at: {sitemap_url}")
+        response = self._session.get(sitemap_url, timeout=15)
+        response.raise_for_status()
+
+        urls = []
+        for _, element in lxml.etree.iterparse(io.BytesIO(response.content), tag='{*}url', resolve_entities=False):
+            loc = element.findtext('{*}loc')
+            if loc:
+                urls.append(loc.strip())
+            element.clear()
+        return urls
+
+    async def discover_structured_content(self, base_url: str) -> List[str]:
+        """Discover structured content using standard web discovery methods
+
+        All sitemap locations are probed concurrently; the first one (in order of
+        preference) that lists pages wins.
+        """
+        loop = asyncio.get_running_loop()
 
         # Common structured content locations
         structured_endpoints = [
@@ -447,76 +873,87 @@ class AskRachaRAG:
             f"{base_url.rstrip('/')}/sitemap-index.xml"
         ]
 
-        for endpoint in structured_endpoints:
-            try:
-                print(f"🔍 Checking structured content at: {endpoint}")
+        results = await asyncio.gather(
+            *(loop.run_in_executor(None, self._fetch_sitemap, endpoint) for endpoint in structured_endpoints),
+            return_exceptions=True
+        )
 
-                # Use specialized reader for structured content
-                content_reader = SitemapReader()
-                documents = content_reader.load_data(sitemap_url=endpoint)
+        for endpoint, urls in zip(structured_endpoints, results):
+            if isinstance(urls, Exception):
+                print(f"⚠️ Structured content discovery failed for {endpoint}: {str(urls)}")
+                continue
+            if urls:
+                print(f"✅ Found {len(urls)} structured content pages")
+                return urls
 
-                if documents:
-                    urls = []
-                    for doc in documents:
-                        source_url = doc.metadata.get(
-                            'loc') or doc.metadata.get('source', endpoint)
-                        if source_url:
-                            urls.append(source_url)
+        return []
 
-                    if urls:
-                        print(f"✅ Found {len(urls)} structured content pages")
-                        return urls
+    async def _scrape_async(self, url: str) -> Tuple[str, Optional[str]]:
+        """Fetch a page on the fetch pool and parse it on the process pool without blocking the loop"""
+        loop = asyncio.get_running_loop()
+        fetch_pool = self._get_fetch_pool()
+        page = await loop.run_in_executor(fetch_pool, self._fetch, url)
 
-            except Exception as e:
-                print(
-                    f"⚠️ Structured content discovery failed for {endpoint}: {str(e)}")
-                continue
+        # Unchanged cached pages skip parsing entirely
+        if 'text' in page:
+            return page['text'], page['title']
 
-        return discovered_urls
+        content, title = await loop.run_in_executor(self._get_parse_pool(), extract_page, page['raw'])
+        await loop.run_in_executor(
+            fetch_pool, self.page_cache.put, url, content, page['etag'], page['last_modified'], title)
+        return content, title
 
-    def process_url_batch(self, urls: List[str]) -> tuple:
-        """Process a batch of URLs and return documents, loaded URLs, and failed URLs"""
+    async def process_url_batch_async(self, urls: List[str]) -> tuple:
+        """Process a batch of URLs and return documents, loaded URLs, and failed URLs
+
+        All pages are fetched concurrently (bounded by the fetch pool size) and each
+        is parsed as soon as it arrives, so parsing overlaps the remaining downloads.
+        """
         documents = []
         loaded_urls = []
         failed_urls = []
 
-        for url in urls:
-            try:
-                content = self.scrape_url_advanced(url)
-
-                if content and len(content) > 200:
-                    doc = Document(
-                        text=content,
-                        metadata={
-                            'source': url,
-                            'title': self.extract_content_title(content),
-                            'length': len(content),
-                            'type': 'documentation_page'
-                        }
-                    )
-                    documents.append(doc)
-                    loaded_urls.append(url)
-                    print(f"✅ Loaded: {len(content)} chars from {url}")
-                else:
-                    failed_urls.append(url)
-                    print(f"❌ Insufficient content from: {url}")
+        if not urls:
+            return documents, loaded_urls, failed_urls
+
+        results = await asyncio.gather(
+            *(self._scrape_async(url) for url in urls),
+            return_exceptions=True
+        )
+
+        # gather keeps input order, so results are deterministic
+        for url, page in zip(urls, results):
+            if isinstance(page, Exception):
+                failed_urls.append(url)
+                print(f"❌ Failed to load {url}: {str(page)}")
+                continue
 
-            except Exception as e:
+            content, title = page
+            if content and len(content) > 200:
+                doc = self._create_page_document(url, content, title)
+                documents.append(doc)
+                loaded_urls.append(url)
+                print(f"✅ Loaded: {len(content)} chars from {url}")
+            else:
                 failed_urls.append(url)
-                print(f"❌ Failed to load {url}: {str(e)}")
+                print(f"❌ Insufficient content from: {url}")
 
         return documents, loaded_urls, failed_urls
 
     async def load_documents_async(self, urls: List[str]) -> Dict:
-        """Load comprehensive documentation asynchronously"""
-        return self.load_comprehensive_documentation(urls)
+        """Load comprehensive documentation without blocking the caller's event loop"""
+        return await self.load_comprehensive_documentation_async(urls)
 
     def load_documents(self, urls: List[str]) -> Dict:
-        """Synchronous wrapper for comprehensive documentation loading"""
-        return asyncio.run(self.load_documents_async(urls))
+        """Load comprehensive documentation synchronously"""
+        return self.load_comprehensive_documentation(urls)
+
+    def query(self, question: str, filters: Optional[Dict[str, str]] = None) -> Dict:
+        """Query the comprehensive knowledge system with enhanced prompting
 
-    def query(self, question: str) -> Dict:
-        """Query the comprehensive knowledge system with enhanced prompting"""
+        filters optionally restricts retrieval to pages with matching 'domain' and/or
+        'path_prefix' metadata (e.g. {'path_prefix': 'concepts'}).
+        """
         try:
             if not self.query_engine:
                 return {
@@ -527,42 +964,43 @@ class AskRachaRAG:
 
             print(f"🤔 Processing query: {question}")
 
-            # Enhanced prompt for comprehensive responses
-            enhanced_question = f"""
-            You are an expert assistant with comprehensive knowledge of the loaded documentation.
-            
-            Please answer the following question based on the provided documentation.
-            Be thorough, accurate, and helpful. Include specific details and examples where available.
-            If you reference features or concepts, explain them clearly for better understanding.
-            If the question cannot be fully answered from the available documentation, clearly indicate this.
-            
-            User Question: {question}
-            
-            Please provide a comprehensive and helpful response:
-            """
-
-            response = self.query_engine.query(enhanced_question)
-
-            # Extract sources with enhanced metadata
-            sources = []
-            if hasattr(response, 'source_nodes'):
-                for node in response.source_nodes:
-                    if hasattr(node, 'metadata'):
-                        source_info = {
-                            'url': node.metadata.get('source', 'Unknown'),
-                            'title': node.metadata.get('title', 'Documentation Page'),
-                            'score': getattr(node, 'score', 0.0),
-                            'snippet': node.text[:150] + "..." if hasattr(node, 'text') else ""
-                        }
-                        sources.append(source_info)
+            if isinstance(filters, dict):
+                filters = {key: value for key, value in filters.items() if key in _FILTER_KEYS and value}
+            else:
+                filters = {}
+
+            cache_key = ('query', normalize_question(question), _SIMILARITY_TOP_K)
+            if filters:
+                cache_key += (tuple(sorted(filters.items())),)
+            cached = self.query_cache.get_exact(cache_key)
+            # Semantic matches aren't scoped by filters, so only unfiltered queries use them
+            question_embedding = None
+            if cached is None and not filters:
+                question_embedding = Settings.embed_model.get_query_embedding(question)
+                cached = self._get_similar_answer(cache_key, question_embedding)
+            if cached is not None:
+                print("⚡ Answered from query cache")
+                cached['question'] = question
+                return cached
+
+            query_engine = self.query_engine
+            if filters:
+                query_engine = RetrieverQueryEngine(
+                    retriever=self._retriever.with_filters(filters),
+                    response_synthesizer=self._response_synthesizer
+                )
+            # Reuse the cache lookup's question embedding instead of embedding the question again
+            response = query_engine.query(QueryBundle(question, embedding=question_embedding))
 
-            return {
+            result = {
                 'success': True,
                 'answer': str(response),
-                'sources': sources,
+                'sources': self._extract_sources(response),
                 'question': question,
                 'model_used': 'gemini-2.0-flash'
             }
+            self._cache_answer(cache_key, result, question_embedding)
+            return result
 
         except Exception as e:
             print(f"Error in query processing: {e}")
@@ -573,14 +1011,102 @@ class AskRachaRAG:
                 'question': question
             }
 
+    async def query_async(self, question: str, filters: Optional[Dict[str, str]] = None) -> Dict:
+        """Query without blocking the caller's event loop
+
+        Retrieval, Gemini calls and cache lookups are all blocking, so the whole query
+        runs on a worker thread and concurrent awaiting callers proceed in parallel.
+        """
+        return await asyncio.to_thread(self.query, question, filters)
+
+    def query_stream(self, question: str) -> Iterator[Dict]:
+        """Stream an answer as 'token' events as Gemini generates it, then a 'done' event with sources"""
+        try:
+            if not self.streaming_query_engine:
+                yield {'type': 'error', 'message': 'No documentation loaded. Please load the knowledge base first.'}
+                return
+
+            print(f"🤔 Streaming query: {question}")
+
+            cache_key = ('query', normalize_question(question), _SIMILARITY_TOP_K)
+            cached = self.query_cache.get_exact(cache_key)
+            if cached is None:
+                question_embedding = Settings.embed_model.get_query_embedding(question)
+                cached = self._get_similar_answer(cache_key, question_embedding)
+            if cached is not None:
+                print("⚡ Answered from query cache")
+                yield {'type': 'token', 'text': cached['answer']}
+                yield {'type': 'done', 'sources': cached['sources'], 'model_used': cached.get('model_used')}
+                return
+
+            response = self.streaming_query_engine.query(QueryBundle(question, embedding=question_embedding))
+
+            tokens = []
+            for token in response.response_gen:
+                tokens.append(token)
+                yield {'type': 'token', 'text': token}
+
+            sources = self._extract_sources(response)
+            self._cache_answer(cache_key, {
+                'success': True,
+                'answer': ''.join(tokens),
+                'sources': sources,
+                'question': question,
+                'model_used': 'gemini-2.0-flash'
+            }, question_embedding)
+            yield {'type': 'done', 'sources': sources, 'model_used': 'gemini-2.0-flash'}
+
+        except Exception as e:
+            print(f"Error in streaming query: {e}")
+            yield {'type': 'error', 'message': f'Sorry, I encountered an error processing your question: {str(e)}'}
+
+    def _clear_answer_caches(self):
+        """Drop cached answers locally and in the shared Pinecone cache once the documents change"""
+        self.query_cache.clear()
+        self.vector_store.clear_cached_answers()
+
+    def _get_similar_answer(self, cache_key: Tuple, question_embedding: List[float]) -> Optional[Dict]:
+        """Find a cached answer to a similar question, locally first and then in the shared Pinecone cache"""
+        cached = self.query_cache.get_similar(question_embedding)
+        if cached is None:
+            cached = self.vector_store.find_cached_answer(
+                question_embedding, self._corpus_version, max_age_seconds=_QA_CACHE_TTL
+            )
+            if cached is not None:
+                self.query_cache.put(cache_key, cached, question_embedding)
+        return cached
+
+    def _cache_answer(self, cache_key: Tuple, result: Dict, question_embedding: Optional[List[float]]):
+        """Cache an answer locally and, for unfiltered questions, in the shared Pinecone cache"""
+        self.query_cache.put(cache_key, result, question_embedding)
+        if question_embedding is not None:
+            # Upsert on the I/O pool so the answer isn't held up by a Pinecone write
+            self._get_fetch_pool().submit(
+                self.vector_store.cache_answer,
+                question_embedding, result['question'], result, self._corpus_version
+            )
+
+    @staticmethod
+    def _extract_sources(response) -> List[Dict]:
+        """Extract sources with enhanced metadata from a query response"""
+        sources = []
+        if hasattr(response, 'source_nodes'):
+            for node in response.source_nodes:
+                if hasattr(node, 'metadata'):
+                    source_info = {
+                        'url': node.metadata.get('source', 'Unknown'),
+                        'title': node.metadata.get('title', 'Documentation Page'),
+                        'score': getattr(node, 'score', 0.0),
+                        'snippet': node.text[:150] + "..." if hasattr(node, 'text') else ""
+                    }
+                    sources.append(source_info)
+        return sources
+
     def get_status(self) -> Dict:
         """Get current system status with comprehensive information"""
-        total_chars = sum(len(doc.text)
-                          for doc in self.documents) if self.documents else 0
-
         return {
-            'documents_loaded': len(self.documents),
-            'total_characters': total_chars,
+            'documents_loaded': len(self.document_manifest),
+            'total_characters': self._total_chars,
             'index_ready': self.index is not None,
             'query_engine_ready': self.query_engine is not None,
             'model_info': {
@@ -588,7 +1114,7 @@ class AskRachaRAG:
                 'embeddings': 'Text Embedding 004',
                 'framework': 'LlamaIndex 0.12.x'
             },
-            'document_sources': [doc.metadata.get('source', 'Unknown') for doc in self.documents] if self.documents else []
+            'document_sources': list(self.document_manifest)
         }
 
     def query_with_context(self, query: str, context: List[Dict]) -> Dict:
@@ -596,65 +1122,59 @@ class AskRachaRAG:
         Generate a response considering the conversation context
         """
         try:
+            cache_key = (
+                'context',
+                normalize_question(query),
+                tuple((msg['role'], msg['content']) for msg in context[-_CONTEXT_TURNS:]),
+                _SIMILARITY_TOP_K
+            )
+            cached = self.query_cache.get_exact(cache_key)
+            if cached is not None:
+                return cached
+
             conversation_context = "\n".join([
                 f"{msg['role']}: {msg['content']}"
-                for msg in context
+                for msg in context[-_CONTEXT_TURNS:]
             ])
-            
-            enhanced_prompt = f"""Previous conversation:
-{conversation_context}
-
-Current question: {query}
-
-Analyze the context and question, then provide:
-1. A decision on whether sources should be shown (true/false) based on:
-   - If the response references technical information
-   - If sources were actually used to generate the response
-   - If the response builds on or clarifies previous technical information
-   - Don't show sources for simple acknowledgments unless they relate to technical content
-
-2. A response that:
-   - Is consistent with the previous conversation
-   - Answers the question directly
-   - Uses simple language for basic questions
-   - Provides detailed technical information only when necessary
-
-Format your response as:
-<show_sources>true/false</show_sources>
-<response>Your actual response here</response>
-"""
-            
-            response = self.query_engine.query(enhanced_prompt)
-            response_text = str(response)
-            
-            response_text = str(response)
-            
-            show_sources = True  
-            if '<show_sources>' in response_text and '</show_sources>' in response_text:
-                show_sources_text = response_text.split('<show_sources>')[1].split('</show_sources>')[0].strip().lower()
-                show_sources = show_sources_text == 'true'
-                
-            if '<response>' in response_text and '</response>' in response_text:
-                response_text = response_text.split('<response>')[1].split('</response>')[0].strip()
-                
+
+            # Retrieve on the conversation as well so follow-ups find the right pages
+            nodes = self.query_engine.retrieve(QueryBundle(f"{conversation_context}\n{query}"))
+
+            prompt = _CONTEXT_PROMPT.format(
+                documentation="\n\n".join(node.get_content() for node in nodes),
+                conversation=conversation_context,
+                question=query
+            )
+            response = self.genai_client.models.generate_content(
+                model='gemini-2.0-flash',
+                contents=prompt,
+                config=_CONTEXT_CONFIG
+            )
+            parsed = orjson.loads(response.text)
+            response_text = parsed['response']
+            show_sources = parsed['show_sources']
+
             if not show_sources:
-                return {
+                result = {
                     "success": True,
                     "response": response_text,
                     "source_nodes": []
                 }
+                self.query_cache.put(cache_key, result)
+                return result
 
+            # Keep nodes scoring above 0.5, selected with one vectorized comparison
+            scores = np.fromiter((node.score or 0.0 for node in nodes), dtype=np.float32, count=len(nodes))
             source_nodes = []
-            if hasattr(response, 'source_nodes'):
-                for node in response.source_nodes:
-                    if hasattr(node, 'score') and float(node.score) > 0.5:
-                        source = {
-                            'url': node.metadata.get('source', '') if hasattr(node, 'metadata') else '',
-                            'title': node.metadata.get('title', 'Documentation') if hasattr(node, 'metadata') else 'Documentation',
-                            'score': float(node.score)
-                        }
-                        if source['url'] and source['title']:
-                            source_nodes.append(source)
+            for i in np.nonzero(scores > 0.5)[0].tolist():
+                metadata = nodes[i].metadata
+                source = {
+                    'url': metadata.get('source', ''),
+                    'title': metadata.get('title', 'Documentation'),
+                    'score': float(scores[i])
+                }
+                if source['url'] and source['title']:
+                    source_nodes.append(source)
 
             result = {
                 "success": True,
@@ -662,6 +1182,7 @@ Format your response as:
                 "source_nodes": source_nodes
             }
             print("DEBUG: Final response with sources:", result)
+            self.query_cache.put(cache_key, result)
             return result
             
         except Exception as e:
@@ -670,6 +1191,29 @@ Format your response as:
                 "message": f"Error generating response: {str(e)}"
             }
             
+    def close(self):
+        """Stop the background event loop and release the worker pools, HTTP connections and caches
+
+        The query cache writes out any answers not yet saved to disk.
+        """
+        if self._loop.is_closed():
+            return
+
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join(timeout=5)
+        if not self._loop.is_running():
+            self._loop.close()
+
+        for pool in (self._fetch_pool, self._parse_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._fetch_pool = None
+        self._parse_pool = None
+
+        self._session.close()
+        self._embedding_cache.close()
+        self.query_cache.close()
+
     def test_connection(self) -> Dict:
         """Test the Gemini API connection"""
         try:
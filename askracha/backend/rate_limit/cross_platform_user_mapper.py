@@ -4,7 +4,8 @@ Provides consistent user identification across web and Discord interfaces.
 """
 import logging
 import hashlib
-from typing import Optional, Dict, Any
+from functools import lru_cache
+from typing import Dict, Any, Mapping
 from dataclasses import dataclass
 
 
@@ -47,14 +48,14 @@ class CrossPlatformUserMapper:
             # For anonymous users, use platform-specific identification
             return f"anon:{platform}:{platform_user_id}"
     
-    def create_web_user_identity(self, request_headers: Dict[str, str], 
-                                session_data: Dict[str, Any], 
+    def create_web_user_identity(self, request_headers: Mapping[str, str], 
+                                session_data: Mapping[str, Any], 
                                 remote_addr: str) -> UserIdentity:
         """
         Create user identity from web request data.
         
         Args:
-            request_headers: HTTP request headers
+            request_headers: HTTP request headers (any mapping with .get)
             session_data: Session data dictionary
             remote_addr: Remote IP address
             
@@ -158,12 +159,7 @@ class CrossPlatformUserMapper:
 
 
 # Global mapper instance
-_user_mapper: Optional[CrossPlatformUserMapper] = None
-
-
+@lru_cache(maxsize=None)
 def get_user_mapper() -> CrossPlatformUserMapper:
-    """Get global user mapper instance (singleton pattern)."""
-    global _user_mapper
-    if _user_mapper is None:
-        _user_mapper = CrossPlatformUserMapper()
-    return _user_mapper
\ No newline at end of file
+    """Get global user mapper instance (singleton, memoized on first call)."""
+    return CrossPlatformUserMapper()
\ No newline at end of file
@@ -3,16 +3,172 @@ Flask middleware for rate limiting enforcement.
 Integrates with the existing Flask application to provide transparent rate limiting.
 """
 import logging
-from functools import wraps
-from typing import Optional, Dict, Any, Callable
-from flask import Flask, request, jsonify, g, Response
+from functools import cached_property, wraps
+from types import MappingProxyType
+from typing import Optional, Dict, Any, Callable, Tuple
+from flask import Flask, request, Response
+from werkzeug.exceptions import HTTPException
 from .rate_limiter import get_rate_limiter, RateLimitResult
-from .cross_platform_user_mapper import get_user_mapper
+from .cross_platform_user_mapper import CrossPlatformUserMapper, get_user_mapper
 
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Shared read-only stand-in for requests without a session, instead of a new {} each time
+_EMPTY_SESSION = MappingProxyType({})
+
+# Flask endpoints (view function names) that are rate limited
+_RATE_LIMITED_ENDPOINTS = frozenset({
+    'query_documents',
+    'stream_query_documents',
+    'create_chat_session',
+    'chat_query',
+})
+
+# WSGI environ key holding the rate limit result of an allowed request
+_RESULT_ENVIRON_KEY = 'askracha.rate_limit_result'
+
+# JSON body of a rate limit violation; only the wait time and the (ASCII ISO) reset time vary
+_RATE_LIMIT_BODY = (
+    b'{"error":"Rate limit exceeded",'
+    b'"message":"Please wait %d seconds before you can ask a question again.",'
+    b'"retry_after":%d,"reset_time":"%s","type":"rate_limit"}'
+)
+
+# Headers that are the same on every rate limit violation (1 request per period)
+_STATIC_429_HEADERS = (
+    ('X-RateLimit-Limit', '1'),
+    ('X-RateLimit-Remaining', '0'),
+)
+
+
+def _extract_user_id(request_obj, user_mapper: CrossPlatformUserMapper) -> str:
+    """
+    Extract user identifier from Flask request using cross-platform mapping.
+    """
+    # Extract request data (headers are read in place; lookups are case-insensitive)
+    headers = request_obj.headers
+    session_data = getattr(request_obj, 'session', _EMPTY_SESSION)
+    remote_addr = request_obj.remote_addr or 'unknown'
+    
+    # Create user identity using cross-platform mapper
+    identity = user_mapper.create_web_user_identity(
+        headers, session_data, remote_addr
+    )
+    
+    return user_mapper.get_rate_limit_key(identity)
+
+
+def _rate_limit_response(result: RateLimitResult) -> Response:
+    """Create JSON response for rate limit violations."""
+    body = _RATE_LIMIT_BODY % (result.remaining_seconds, result.remaining_seconds, result.reset_iso.encode())
+    response = Response(body, status=429, mimetype='application/json')
+    
+    # Add standard rate limit headers
+    response.headers.extend((
+        *_STATIC_429_HEADERS,
+        ('X-RateLimit-Reset', str(result.reset_epoch)),
+        ('Retry-After', str(result.remaining_seconds)),
+    ))
+    
+    return response
+
+
+def _success_headers(result: RateLimitResult) -> tuple:
+    """Rate limit headers for an allowed request, ready to extend a header list with."""
+    return (
+        ('X-RateLimit-Limit', '1'),  # 1 request per period
+        ('X-RateLimit-Remaining', '0'),  # remaining is 0 until reset
+        ('X-RateLimit-Reset', str(result.reset_epoch)),
+    )
+
+
+class RateLimitWSGI:
+    """
+    WSGI wrapper that enforces rate limits before Flask dispatches the request.
+    The request is routed exactly as Flask routes it, so only requests that will
+    reach a rate-limited view spend a token.
+    """
+    
+    def __init__(self, wsgi_app: Callable, middleware: 'RateLimitMiddleware'):
+        """Wrap the Flask app's WSGI callable."""
+        self.wsgi_app = wsgi_app
+        self.middleware = middleware
+    
+    @cached_property
+    def _path_prefixes(self) -> Tuple[str, ...]:
+        """Static path prefixes of the rate-limited rules, for a cheap PATH_INFO pre-check
+
+        Built on the first request, once every route is registered. Each prefix is the rule
+        up to its first variable part, without a trailing slash so strict-slash redirects match.
+        """
+        return tuple({
+            rule.rule.split('<', 1)[0].rstrip('/')
+            for rule in self.middleware.app.url_map.iter_rules()
+            if self.middleware._should_rate_limit_endpoint(rule.endpoint)
+        })
+    
+    def _check(self, request_obj) -> Optional[RateLimitResult]:
+        """Check the rate limit for the request's user, or None if checking failed."""
+        try:
+            user_id = self.middleware._get_user_identifier(request_obj)
+            result = self.middleware.rate_limiter.check_rate_limit(user_id)
+            
+            if result.allowed:
+                logger.debug(f"Rate limit check passed for user {user_id}")
+            else:
+                logger.info(f"Rate limit exceeded for user {user_id}, {result.remaining_seconds}s remaining")
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error in rate limit middleware: {e}")
+            return None
+    
+    def __call__(self, environ, start_response):
+        """Rate limit matching requests, then call through to the Flask app."""
+        # Skip OPTIONS requests (CORS preflight)
+        if environ.get('REQUEST_METHOD') == 'OPTIONS':
+            return self.wsgi_app(environ, start_response)
+        
+        # Most paths can't reach a rate-limited view; skip them before building a request
+        if not environ.get('PATH_INFO', '').startswith(self._path_prefixes):
+            return self.wsgi_app(environ, start_response)
+        
+        # Resolve the endpoint with Flask's own URL adapter (SCRIPT_NAME, variable rules,
+        # methods); 404s, 405s and redirects pass through for Flask to answer
+        app = self.middleware.app
+        request_obj = app.request_class(environ)
+        try:
+            rule, _ = app.create_url_adapter(request_obj).match(return_rule=True)
+        except HTTPException:
+            return self.wsgi_app(environ, start_response)
+        
+        if not self.middleware._should_rate_limit_endpoint(rule.endpoint):
+            return self.wsgi_app(environ, start_response)
+        
+        result = self._check(request_obj)
+        
+        # Fail open - allow request if rate limiting fails
+        if result is None:
+            return self.wsgi_app(environ, start_response)
+        
+        if not result.allowed:
+            # Run the app's after_request handlers (CORS) on the 429 without dispatching
+            with app.request_context(environ):
+                response = app.process_response(_rate_limit_response(result))
+            return response(environ, start_response)
+        
+        # Make the result available to the view via get_rate_limit_result()
+        environ[_RESULT_ENVIRON_KEY] = result
+        rate_limit_headers = _success_headers(result)
+        
+        def start_response_with_rate_limit_headers(status, headers, exc_info=None):
+            headers.extend(rate_limit_headers)
+            return start_response(status, headers, exc_info)
+        
+        return self.wsgi_app(environ, start_response_with_rate_limit_headers)
+
 
 class RateLimitMiddleware:
     """Flask middleware for rate limiting enforcement."""
@@ -22,11 +178,6 @@ class RateLimitMiddleware:
         self.app = app
         self.rate_limiter = get_rate_limiter()
         self.user_mapper = get_user_mapper()
-        self.rate_limited_endpoints = {
-            'query_documents',
-            'create_chat_session',
-            'chat_query',
-        }
         
         if app is not None:
             self.init_app(app)
@@ -35,122 +186,25 @@ class RateLimitMiddleware:
         """Initialize middleware with Flask app."""
         self.app = app
         
-        # Register before_request handler
-        @app.before_request
-        def before_request_handler():
-            return self._before_request_handler()
-        
-        # Register after_request handler for rate limit headers
-        @app.after_request
-        def after_request_handler(response):
-            return self._after_request_handler(response)
+        # Wrap the WSGI app so only rate-limited paths pay for rate limiting
+        app.wsgi_app = RateLimitWSGI(app.wsgi_app, self)
     
     def _get_user_identifier(self, request_obj) -> str:
-        """
-        Extract user identifier from Flask request using cross-platform mapping.
-        """
-        # Extract request data
-        headers = dict(request_obj.headers)
-        session_data = getattr(request_obj, 'session', {})
-        remote_addr = request_obj.remote_addr or 'unknown'
-        
-        # Create user identity using cross-platform mapper
-        identity = self.user_mapper.create_web_user_identity(
-            headers, session_data, remote_addr
-        )
-        
-        return self.user_mapper.get_rate_limit_key(identity)
+        """Extract user identifier from Flask request using cross-platform mapping."""
+        return _extract_user_id(request_obj, self.user_mapper)
     
     def _should_rate_limit_endpoint(self, endpoint: Optional[str]) -> bool:
         """Check if the current endpoint should be rate limited."""
-        if not endpoint:
-            return False
-        return endpoint in self.rate_limited_endpoints
+        return endpoint in _RATE_LIMITED_ENDPOINTS
     
     def _create_rate_limit_response(self, result: RateLimitResult) -> Response:
         """Create JSON response for rate limit violations."""
-        response_data = {
-            'error': 'Rate limit exceeded',
-            'message': f'Please wait {result.remaining_seconds} seconds before you can ask a question again.',
-            'retry_after': result.remaining_seconds,
-            'reset_time': result.reset_time.isoformat(),
-            'type': 'rate_limit'
-        }
-        
-        response = jsonify(response_data)
-        response.status_code = 429
-        
-        # Add standard rate limit headers
-        response.headers['X-RateLimit-Limit'] = '1'  # 1 request per period
-        response.headers['X-RateLimit-Remaining'] = '0'
-        response.headers['X-RateLimit-Reset'] = str(int(result.reset_time.timestamp()))
-        response.headers['Retry-After'] = str(result.remaining_seconds)
-        
-        return response
-    
-    def _before_request_handler(self):
-        """Handle rate limiting before each request."""
-        # Skip rate limiting for non-rate-limited endpoints
-        if not self._should_rate_limit_endpoint(request.endpoint):
-            return None
-        
-        # Skip rate limiting for OPTIONS requests (CORS preflight)
-        if request.method == 'OPTIONS':
-            return None
-        
-        try:
-            # Get user identifier
-            user_id = self._get_user_identifier(request)
-            
-            # Check rate limit
-            result = self.rate_limiter.check_rate_limit(user_id)
-            
-            # Store result in Flask's g object for use in after_request
-            g.rate_limit_result = result
-            g.rate_limit_user_id = user_id
-            
-            # If rate limited, return error response
-            if not result.allowed:
-                logger.info(f"Rate limit exceeded for user {user_id}, {result.remaining_seconds}s remaining")
-                return self._create_rate_limit_response(result)
-            
-            logger.debug(f"Rate limit check passed for user {user_id}")
-            return None
-            
-        except Exception as e:
-            logger.error(f"Error in rate limit middleware: {e}")
-            # Fail open - allow request if rate limiting fails
-            return None
-    
-    def _after_request_handler(self, response: Response) -> Response:
-        """Add rate limit headers to successful responses."""
-        try:
-            # Only add headers for rate-limited endpoints
-            if not self._should_rate_limit_endpoint(request.endpoint):
-                return response
-            
-            # Get rate limit result from g object
-            result = getattr(g, 'rate_limit_result', None)
-            user_id = getattr(g, 'rate_limit_user_id', None)
-            
-            if result and user_id:
-                # Add rate limit headers to successful responses
-                response.headers['X-RateLimit-Limit'] = '1'  # 1 request per period
-                
-                if result.allowed:
-                    # For successful requests, remaining is 0 until reset
-                    response.headers['X-RateLimit-Remaining'] = '0'
-                    response.headers['X-RateLimit-Reset'] = str(int(result.reset_time.timestamp()))
-                else:
-                    # This shouldn't happen for successful responses, but handle it
-                    response.headers['X-RateLimit-Remaining'] = '0'
-                    response.headers['X-RateLimit-Reset'] = str(int(result.reset_time.timestamp()))
-            
-            return response
-            
-        except Exception as e:
-            logger.error(f"Error adding rate limit headers: {e}")
-            return response
+        return _rate_limit_response(result)
+
+
+def get_rate_limit_result() -> Optional[RateLimitResult]:
+    """Rate limit result for the current request, if it was rate limited and allowed."""
+    return request.environ.get(_RESULT_ENVIRON_KEY)
 
 
 def rate_limit_required(f: Callable) -> Callable:
@@ -158,49 +212,32 @@ def rate_limit_required(f: Callable) -> Callable:
     Decorator to enforce rate limiting on specific Flask routes.
     Alternative to middleware for more granular control.
     """
+    user_mapper = get_user_mapper()
+    
     @wraps(f)
     def decorated_function(*args, **kwargs):
         rate_limiter = get_rate_limiter()
         
         try:
             # Get user identifier using the same logic as middleware
-            middleware = RateLimitMiddleware()
-            user_id = middleware._get_user_identifier(request)
+            user_id = _extract_user_id(request, user_mapper)
             
             # Check rate limit
             result = rate_limiter.check_rate_limit(user_id)
             
             if not result.allowed:
                 logger.info(f"Rate limit exceeded for user {user_id}, {result.remaining_seconds}s remaining")
-                response_data = {
-                    'error': 'Rate limit exceeded',
-                    'message': f'Please wait {result.remaining_seconds} seconds before you can ask a question again.',
-                    'retry_after': result.remaining_seconds,
-                    'reset_time': result.reset_time.isoformat(),
-                    'type': 'rate_limit'
-                }
-                
-                response = jsonify(response_data)
-                response.status_code = 429
-                response.headers['X-RateLimit-Limit'] = '1'
-                response.headers['X-RateLimit-Remaining'] = '0'
-                response.headers['X-RateLimit-Reset'] = str(int(result.reset_time.timestamp()))
-                response.headers['Retry-After'] = str(result.remaining_seconds)
-                
-                return response
+                return _rate_limit_response(result)
             
             # Store rate limit info for potential use in the route
-            g.rate_limit_result = result
-            g.rate_limit_user_id = user_id
+            request.environ[_RESULT_ENVIRON_KEY] = result
             
             # Call the original function
             response = f(*args, **kwargs)
             
             # Add rate limit headers to successful responses
             if hasattr(response, 'headers'):
-                response.headers['X-RateLimit-Limit'] = '1'
-                response.headers['X-RateLimit-Remaining'] = '0'
-                response.headers['X-RateLimit-Reset'] = str(int(result.reset_time.timestamp()))
+                response.headers.extend(_success_headers(result))
             
             return response
             
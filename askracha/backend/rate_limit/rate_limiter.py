@@ -1,13 +1,17 @@
 """
-Redis-based rate limiting service for AskRacha.
+Redis-based rate limiting service for AskRacha, with an in-process alternative for
+single-process deployments.
 Provides per-user rate limiting with configurable parameters and cross-platform consistency.
 """
-import asyncio
 import logging
+import math
+import threading
 import time
+from collections import OrderedDict
 from dataclasses import dataclass
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, Union
+from functools import cached_property, lru_cache
+from datetime import datetime
+from typing import Optional, Dict, Any, Iterable, Tuple
 import re
 import os
 import redis
@@ -17,6 +21,43 @@ from redis.connection import ConnectionPool
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Characters allowed in the user part of a Redis key
+_KEY_SANITIZER = re.compile(r'[^a-zA-Z0-9_\-@.]')
+
+# Atomic token bucket kept in a hash (tokens, ts in integer Unix ms). ARGV: capacity,
+# refill rate (tokens/s). Refills for the time elapsed on the Redis server's clock, then
+# takes a token if one is available. Returns {allowed (1/0), ms until the next token}.
+_CHECK_SCRIPT = """
+-- Replicate the writes rather than the script, since it reads the server clock (Redis < 7)
+redis.replicate_commands()
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2]) / 1000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+if tokens < 1 then
+    return {0, math.ceil((1 - tokens) / rate)}
+end
+tokens = tokens - 1
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+-- Once the bucket would be full again its state is the default, so let it expire
+redis.call('PEXPIRE', KEYS[1], math.max(1, math.ceil((capacity - tokens) / rate)))
+return {1, math.ceil(math.max(0, 1 - tokens) / rate)}
+"""
+
+# Denied users recorded between sweeps of expired entries from the deny cache
+_DENY_CACHE_PURGE_INTERVAL = 1024
+
+
+@lru_cache(maxsize=8192)
+def _build_rate_limit_key(prefix: str, user_id: str) -> str:
+    """Build the Redis key for a user, memoized since the same users recur."""
+    # Sanitize user_id to prevent Redis key injection
+    return f"{prefix}:{_KEY_SANITIZER.sub('_', user_id)}"
+
 
 @dataclass
 class RateLimitConfig:
@@ -29,6 +70,9 @@ class RateLimitConfig:
     redis_max_connections: int = 10
     key_prefix: str = "askracha:ratelimit"
     redis_url: Optional[str] = None  # Support for Redis URL
+    capacity: int = 1  # Burst size: requests allowed back to back
+    refill_rate: Optional[float] = None  # Tokens per second (None: 1 per default_limit_seconds)
+    backend: str = "redis"  # 'redis', or 'local' for an in-process limiter (single process only)
     
     @classmethod
     def from_env(cls) -> 'RateLimitConfig':
@@ -42,7 +86,10 @@ class RateLimitConfig:
                 default_limit_seconds=int(os.getenv('RATE_LIMIT_SECONDS', '60')),
                 redis_url=redis_url,
                 redis_max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', '10')),
-                key_prefix=os.getenv('RATE_LIMIT_KEY_PREFIX', 'askracha:ratelimit')
+                key_prefix=os.getenv('RATE_LIMIT_KEY_PREFIX', 'askracha:ratelimit'),
+                capacity=int(os.getenv('RATE_LIMIT_CAPACITY', '1')),
+                refill_rate=float(os.getenv('RATE_LIMIT_REFILL_RATE')) if os.getenv('RATE_LIMIT_REFILL_RATE') else None,
+                backend=os.getenv('RATE_LIMIT_BACKEND', 'redis')
             )
         else:
             # Fall back to individual parameters
@@ -53,7 +100,10 @@ class RateLimitConfig:
                 redis_db=int(os.getenv('REDIS_DB', '0')),
                 redis_password=os.getenv('REDIS_PASSWORD'),
                 redis_max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', '10')),
-                key_prefix=os.getenv('RATE_LIMIT_KEY_PREFIX', 'askracha:ratelimit')
+                key_prefix=os.getenv('RATE_LIMIT_KEY_PREFIX', 'askracha:ratelimit'),
+                capacity=int(os.getenv('RATE_LIMIT_CAPACITY', '1')),
+                refill_rate=float(os.getenv('RATE_LIMIT_REFILL_RATE')) if os.getenv('RATE_LIMIT_REFILL_RATE') else None,
+                backend=os.getenv('RATE_LIMIT_BACKEND', 'redis')
             )
 
 
@@ -62,15 +112,25 @@ class RateLimitResult:
     """Result of a rate limit check."""
     allowed: bool
     remaining_seconds: int
-    reset_time: datetime
+    reset_epoch: int  # Unix time (whole seconds, rounded up) when the next request is allowed
     user_id: str
     
+    @cached_property
+    def reset_time(self) -> datetime:
+        """Reset time as a local datetime."""
+        return datetime.fromtimestamp(self.reset_epoch)
+    
+    @cached_property
+    def reset_iso(self) -> str:
+        """Reset time in ISO 8601 format, formatted once."""
+        return self.reset_time.isoformat()
+    
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for JSON serialization."""
         return {
             'allowed': self.allowed,
             'remaining_seconds': self.remaining_seconds,
-            'reset_time': self.reset_time.isoformat(),
+            'reset_time': self.reset_iso,
             'user_id': self.user_id
         }
 
@@ -83,6 +143,13 @@ class RateLimiter:
         self.config = config or RateLimitConfig.from_env()
         self._redis_pool: Optional[ConnectionPool] = None
         self._redis_client: Optional[redis.Redis] = None
+        self._check_script = None
+        # user_id -> {limit_seconds: (monotonic deadline, reset_epoch)} of checks Redis
+        # last denied. Per process: a reset made by another process doesn't clear it, so
+        # there a reset user stays denied until the cached wait (at most one period) ends
+        self._deny_cache: Dict[str, Dict[Optional[int], Tuple[float, int]]] = {}
+        self._deny_cache_inserts = 0
+        self._deny_cache_lock = threading.Lock()
         
     def _get_redis_client(self) -> redis.Redis:
         """Get Redis client with connection pooling."""
@@ -93,7 +160,7 @@ class RateLimiter:
                     self._redis_pool = ConnectionPool.from_url(
                         self.config.redis_url,
                         max_connections=self.config.redis_max_connections,
-                        decode_responses=True
+                        decode_responses=False
                     )
                 else:
                     self._redis_pool = ConnectionPool(
@@ -102,16 +169,56 @@ class RateLimiter:
                         db=self.config.redis_db,
                         password=self.config.redis_password,
                         max_connections=self.config.redis_max_connections,
-                        decode_responses=True
+                        decode_responses=False
                     )
             self._redis_client = redis.Redis(connection_pool=self._redis_pool)
+            # Runs via EVALSHA, falling back to EVAL if Redis doesn't have the script yet
+            self._check_script = self._redis_client.register_script(_CHECK_SCRIPT)
         return self._redis_client
     
+    def _get_refill_rate(self, limit_seconds: Optional[int] = None) -> float:
+        """Tokens per second: one per limit_seconds if given, else the configured rate."""
+        if limit_seconds:
+            return 1 / limit_seconds
+        return self.config.refill_rate or 1 / self.config.default_limit_seconds
+    
     def _get_rate_limit_key(self, user_id: str) -> str:
         """Generate Redis key for user rate limit."""
-        # Sanitize user_id to prevent Redis key injection
-        sanitized_user_id = re.sub(r'[^a-zA-Z0-9_\-@.]', '_', user_id)
-        return f"{self.config.key_prefix}:{sanitized_user_id}"
+        return _build_rate_limit_key(self.config.key_prefix, user_id)
+    
+    def _cached_denial(self, user_id: str, limit_seconds: Optional[int]) -> Optional[RateLimitResult]:
+        """A still-running denial of this check from the deny cache, if any."""
+        with self._deny_cache_lock:
+            denial = self._deny_cache.get(user_id, {}).get(limit_seconds)
+        if denial is None:
+            return None
+        remaining = denial[0] - time.monotonic()
+        if remaining <= 0:
+            return None
+        return RateLimitResult(
+            allowed=False,
+            remaining_seconds=math.ceil(remaining),
+            reset_epoch=denial[1],
+            user_id=user_id
+        )
+    
+    def _remember_denial(self, result: RateLimitResult, limit_seconds: Optional[int], wait_ms: int):
+        """Cache a denial so the user's retries skip Redis until the wait is over."""
+        denial = (time.monotonic() + wait_ms / 1000, result.reset_epoch)
+        with self._deny_cache_lock:
+            self._deny_cache.setdefault(result.user_id, {})[limit_seconds] = denial
+            self._deny_cache_inserts += 1
+            if self._deny_cache_inserts % _DENY_CACHE_PURGE_INTERVAL == 0:
+                now = time.monotonic()
+                for user_id, denials in list(self._deny_cache.items()):
+                    if all(deadline <= now for deadline, _ in denials.values()):
+                        del self._deny_cache[user_id]
+    
+    def _forget_denials(self, user_ids: Iterable[str]):
+        """Drop every cached denial of these users, whatever the limit."""
+        with self._deny_cache_lock:
+            for user_id in user_ids:
+                self._deny_cache.pop(user_id, None)
     
     def check_rate_limit(self, user_id: str, limit_seconds: Optional[int] = None) -> RateLimitResult:
         """
@@ -119,83 +226,58 @@ class RateLimiter:
         
         Args:
             user_id: Unique identifier for the user
-            limit_seconds: Custom rate limit duration (uses default if None)
+            limit_seconds: Custom interval between requests, overriding the
+                configured refill rate (uses default if None)
             
         Returns:
             RateLimitResult with rate limit status and timing information
         """
         if not user_id:
             raise ValueError("user_id cannot be empty")
-            
-        limit_seconds = limit_seconds or self.config.default_limit_seconds
-        redis_client = self._get_redis_client()
+        
+        # A check denied until later is still denied; tokens only refill with time
+        denial = self._cached_denial(user_id, limit_seconds)
+        if denial is not None:
+            return denial
+        
+        refill_rate = self._get_refill_rate(limit_seconds)
+        self._get_redis_client()  # also registers the check script
         key = self._get_rate_limit_key(user_id)
         
         try:
-            # Get current timestamp
-            current_time = time.time()
-            
-            # Check if user has an existing rate limit entry
-            last_request_time = redis_client.get(key)
-            
-            if last_request_time is None:
-                # No previous request, allow and set timestamp
-                redis_client.setex(key, limit_seconds, str(current_time))
-                reset_time = datetime.fromtimestamp(current_time + limit_seconds)
-                return RateLimitResult(
-                    allowed=True,
-                    remaining_seconds=0,
-                    reset_time=reset_time,
-                    user_id=user_id
-                )
-            
-            # Calculate time since last request
-            last_time = float(last_request_time)
-            time_elapsed = current_time - last_time
+            # Refill and take a token in one atomic round trip, so concurrent
+            # requests can't both spend the same token. Elapsed time is measured on
+            # the Redis clock, so app servers' clocks never skew it
+            allowed, wait_ms = self._check_script(
+                keys=[key], args=[self.config.capacity, refill_rate]
+            )
             
-            if time_elapsed >= limit_seconds:
-                # Rate limit period has passed, allow and update timestamp
-                redis_client.setex(key, limit_seconds, str(current_time))
-                reset_time = datetime.fromtimestamp(current_time + limit_seconds)
-                return RateLimitResult(
-                    allowed=True,
-                    remaining_seconds=0,
-                    reset_time=reset_time,
-                    user_id=user_id
-                )
-            else:
-                # Still within rate limit period, deny request
-                remaining_seconds = int(limit_seconds - time_elapsed)
-                reset_time = datetime.fromtimestamp(last_time + limit_seconds)
-                return RateLimitResult(
-                    allowed=False,
-                    remaining_seconds=remaining_seconds,
-                    reset_time=reset_time,
-                    user_id=user_id
-                )
-                
-        except redis.RedisError as e:
-            logger.error(f"Redis error in rate limiting for user {user_id}: {e}")
-            # Fail open - allow request if Redis is unavailable
-            return RateLimitResult(
-                allowed=True,
-                remaining_seconds=0,
-                reset_time=datetime.now() + timedelta(seconds=limit_seconds),
+            # The local clock only places the reset time for display
+            now_ms = time.time_ns() // 1_000_000
+            result = RateLimitResult(
+                allowed=bool(allowed),
+                remaining_seconds=0 if allowed else -(-wait_ms // 1000),
+                reset_epoch=-(-(now_ms + wait_ms) // 1000),
                 user_id=user_id
             )
+            if not allowed:
+                self._remember_denial(result, limit_seconds, wait_ms)
+            return result
+                
         except Exception as e:
-            logger.error(f"Unexpected error in rate limiting for user {user_id}: {e}")
-            # Fail open - allow request on unexpected errors
+            logger.error(f"Error in rate limiting for user {user_id}: {e}")
+            # Fail open - allow request if Redis is unavailable or anything else fails
             return RateLimitResult(
                 allowed=True,
                 remaining_seconds=0,
-                reset_time=datetime.now() + timedelta(seconds=limit_seconds),
+                reset_epoch=math.ceil(time.time()) + (limit_seconds or self.config.default_limit_seconds),
                 user_id=user_id
             )
     
     def reset_user_rate_limit(self, user_id: str) -> bool:
         """
         Reset rate limit for a specific user (admin function).
+        Other processes keep their cached denial of the user until it expires.
         
         Args:
             user_id: User identifier to reset
@@ -205,20 +287,45 @@ class RateLimiter:
         """
         if not user_id:
             return False
-            
+        
+        self._forget_denials((user_id,))
         try:
             redis_client = self._get_redis_client()
             key = self._get_rate_limit_key(user_id)
             result = redis_client.delete(key)
             logger.info(f"Rate limit reset for user {user_id}")
             return result > 0
-        except redis.RedisError as e:
-            logger.error(f"Redis error resetting rate limit for user {user_id}: {e}")
-            return False
         except Exception as e:
-            logger.error(f"Unexpected error resetting rate limit for user {user_id}: {e}")
+            logger.error(f"Error resetting rate limit for user {user_id}: {e}")
             return False
     
+    def reset_users_rate_limit(self, user_ids: Iterable[str]) -> int:
+        """
+        Reset rate limits for several users at once (admin function).
+        Other processes keep their cached denials of the users until they expire.
+        
+        Args:
+            user_ids: User identifiers to reset
+            
+        Returns:
+            Number of users whose rate limit was active and got reset
+        """
+        user_ids = [user_id for user_id in user_ids if user_id]
+        self._forget_denials(user_ids)
+        keys = [self._get_rate_limit_key(user_id) for user_id in user_ids]
+        if not keys:
+            return 0
+            
+        try:
+            # One multi-key DEL, so a bulk reset is a single round trip
+            redis_client = self._get_redis_client()
+            result = redis_client.delete(*keys)
+            logger.info(f"Rate limit reset for {len(keys)} users")
+            return result
+        except Exception as e:
+            logger.error(f"Error resetting rate limits for {len(keys)} users: {e}")
+            return 0
+    
     def get_user_rate_limit_status(self, user_id: str) -> Optional[RateLimitResult]:
         """
         Get current rate limit status for a user without affecting the limit.
@@ -236,32 +343,33 @@ class RateLimiter:
             redis_client = self._get_redis_client()
             key = self._get_rate_limit_key(user_id)
             
-            last_request_time = redis_client.get(key)
-            if last_request_time is None:
+            # Read the bucket and the Redis clock together in one round trip
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hmget(key, 'tokens', 'ts')
+            pipe.time()
+            (tokens, ts), (server_seconds, server_micros) = pipe.execute()
+            if tokens is None:
                 return None
-                
-            current_time = time.time()
-            last_time = float(last_request_time)
-            time_elapsed = current_time - last_time
             
-            if time_elapsed >= self.config.default_limit_seconds:
+            # Same refill as the check script, without taking a token
+            # (replies are raw bytes; float() and int() parse them directly)
+            server_ms = server_seconds * 1000 + server_micros // 1000
+            refill_rate = self._get_refill_rate()
+            tokens = min(self.config.capacity, float(tokens) + max(0, server_ms - int(ts)) * refill_rate / 1000)
+            if tokens >= 1:
                 return None
-                
-            remaining_seconds = int(self.config.default_limit_seconds - time_elapsed)
-            reset_time = datetime.fromtimestamp(last_time + self.config.default_limit_seconds)
             
+            wait_ms = math.ceil((1 - tokens) / refill_rate * 1000)
+            now_ms = time.time_ns() // 1_000_000
             return RateLimitResult(
                 allowed=False,
-                remaining_seconds=remaining_seconds,
-                reset_time=reset_time,
+                remaining_seconds=-(-wait_ms // 1000),
+                reset_epoch=-(-(now_ms + wait_ms) // 1000),
                 user_id=user_id
             )
             
-        except redis.RedisError as e:
-            logger.error(f"Redis error checking rate limit status for user {user_id}: {e}")
-            return None
         except Exception as e:
-            logger.error(f"Unexpected error checking rate limit status for user {user_id}: {e}")
+            logger.error(f"Error checking rate limit status for user {user_id}: {e}")
             return None
     
     def health_check(self) -> bool:
@@ -287,13 +395,139 @@ class RateLimiter:
             self._redis_pool.disconnect()
 
 
-# Global rate limiter instance
-_rate_limiter: Optional[RateLimiter] = None
+# Number of independently locked bucket maps in LocalRateLimiter (a power of two)
+_LOCAL_SHARDS = 64
+
+# Least recently used buckets looked at per insert when a shard is over capacity
+_LOCAL_EVICT_SCAN = 8
+
+
+class LocalRateLimiter(RateLimiter):
+    """
+    In-process token-bucket rate limiter with the same interface and semantics.
+    Skips the Redis round trip entirely, but limits are per process, so it only
+    suits deployments where one worker process serves every request.
+    """
+    
+    def __init__(self, config: Optional[RateLimitConfig] = None, max_entries: int = 100_000):
+        """Initialize sharded bucket maps, each an LRU bounded to its share of max_entries."""
+        super().__init__(config)
+        self._shard_capacity = max(1, max_entries // _LOCAL_SHARDS)
+        self._shards = [OrderedDict() for _ in range(_LOCAL_SHARDS)]
+        self._locks = [threading.Lock() for _ in range(_LOCAL_SHARDS)]
+    
+    def _get_shard(self, user_id: str):
+        """Get the bucket map and lock for a user; users in other shards never contend."""
+        index = hash(user_id) & (_LOCAL_SHARDS - 1)
+        return self._shards[index], self._locks[index]
+    
+    def _evict_full_bucket(self, shard: OrderedDict, now: float):
+        """
+        Drop the least recently used bucket that has refilled to capacity, since
+        forgetting it changes nothing. Buckets still refilling are kept, letting the
+        shard run over capacity rather than handing their users a fresh bucket.
+        """
+        capacity = self.config.capacity
+        refill_rate = self._get_refill_rate()
+        for scanned, (user_id, (tokens, updated)) in enumerate(shard.items()):
+            if scanned == _LOCAL_EVICT_SCAN:
+                return
+            if tokens + (now - updated) * refill_rate >= capacity:
+                del shard[user_id]
+                return
+    
+    def check_rate_limit(self, user_id: str, limit_seconds: Optional[int] = None) -> RateLimitResult:
+        """Check if user is within rate limit (see RateLimiter.check_rate_limit)."""
+        if not user_id:
+            raise ValueError("user_id cannot be empty")
+        
+        refill_rate = self._get_refill_rate(limit_seconds)
+        capacity = self.config.capacity
+        shard, lock = self._get_shard(user_id)
+        
+        with lock:
+            now = time.monotonic()
+            bucket = shard.get(user_id)
+            tokens = capacity if bucket is None else min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+                shard[user_id] = (tokens, now)
+                if len(shard) > self._shard_capacity:
+                    self._evict_full_bucket(shard, now)
+            # Denied users are active too, so they stay out of eviction's way
+            shard.move_to_end(user_id)
+        
+        wait_seconds = max(0.0, 1 - tokens) / refill_rate
+        return RateLimitResult(
+            allowed=allowed,
+            remaining_seconds=0 if allowed else math.ceil(wait_seconds),
+            reset_epoch=math.ceil(time.time() + wait_seconds),
+            user_id=user_id
+        )
+    
+    def reset_user_rate_limit(self, user_id: str) -> bool:
+        """Reset rate limit for a specific user (admin function)."""
+        if not user_id:
+            return False
+        
+        shard, lock = self._get_shard(user_id)
+        with lock:
+            removed = shard.pop(user_id, None) is not None
+        logger.info(f"Rate limit reset for user {user_id}")
+        return removed
+    
+    def reset_users_rate_limit(self, user_ids: Iterable[str]) -> int:
+        """Reset rate limits for several users at once (admin function)."""
+        reset = 0
+        for user_id in user_ids:
+            if not user_id:
+                continue
+            shard, lock = self._get_shard(user_id)
+            with lock:
+                reset += shard.pop(user_id, None) is not None
+        logger.info(f"Rate limit reset for {reset} users")
+        return reset
+    
+    def get_user_rate_limit_status(self, user_id: str) -> Optional[RateLimitResult]:
+        """Get current rate limit status for a user without affecting the limit."""
+        if not user_id:
+            return None
+        
+        shard, lock = self._get_shard(user_id)
+        with lock:
+            bucket = shard.get(user_id)
+        if bucket is None:
+            return None
+        
+        refill_rate = self._get_refill_rate()
+        tokens = min(self.config.capacity, bucket[0] + (time.monotonic() - bucket[1]) * refill_rate)
+        if tokens >= 1:
+            return None
+        
+        wait_seconds = (1 - tokens) / refill_rate
+        return RateLimitResult(
+            allowed=False,
+            remaining_seconds=math.ceil(wait_seconds),
+            reset_epoch=math.ceil(time.time() + wait_seconds),
+            user_id=user_id
+        )
+    
+    def health_check(self) -> bool:
+        """The in-process limiter has no external dependency, so it is always healthy."""
+        return True
+    
+    def close(self):
+        """Drop all buckets."""
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                shard.clear()
 
 
+@lru_cache(maxsize=None)
 def get_rate_limiter() -> RateLimiter:
-    """Get global rate limiter instance (singleton pattern)."""
-    global _rate_limiter
-    if _rate_limiter is None:
-        _rate_limiter = RateLimiter()
-    return _rate_limiter
\ No newline at end of file
+    """Get global rate limiter instance (singleton, memoized on first call)."""
+    config = RateLimitConfig.from_env()
+    if config.backend == 'local':
+        return LocalRateLimiter(config)
+    return RateLimiter(config)
\ No newline at end of file
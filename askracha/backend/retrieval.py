@@ -0,0 +1,157 @@
+import copy
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+# Rows quantized or scored per step, bounding the scratch space
+_SCORE_BLOCK_ROWS = 1024
+
+
+def _quantize_rows(vectors: np.ndarray):
+    """Unit-normalize float32 rows and quantize each to int8 with one symmetric scale"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1.0, norms)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(vectors / scales[:, np.newaxis]).astype(np.int8), scales.astype(np.float32)
+
+
+class QuantizedEmbeddings:
+    """int8 embeddings for the nodes of a SimpleVectorStore-backed index
+
+    The index's vector store holds each embedding as a Python float list. sync() moves
+    those into int8 rows and empties the lists, keeping the keys so the vector store can
+    still delete nodes; the rows are persisted alongside the index with save()/load().
+    Arrays are replaced, never modified, so retrievers built earlier stay consistent.
+    """
+
+    def __init__(self, node_ids: Optional[List[str]] = None,
+                 matrix: Optional[np.ndarray] = None, scales: Optional[np.ndarray] = None):
+        self.node_ids: List[str] = node_ids or []
+        self.matrix = matrix if matrix is not None else np.empty((0, 0), dtype=np.int8)
+        self.scales = scales if scales is not None else np.empty(0, dtype=np.float32)
+
+    def sync(self, embedding_dict: Dict[str, List[float]]) -> int:
+        """Drop rows for deleted nodes and quantize embeddings added since the last sync
+
+        Returns how many nodes have neither a float embedding nor an int8 row.
+        """
+        # Nodes with a float embedding are new, or were re-added and replace their old row
+        new_ids = [node_id for node_id, embedding in embedding_dict.items() if len(embedding)]
+        fresh = set(new_ids)
+        keep = [row for row, node_id in enumerate(self.node_ids)
+                if node_id in embedding_dict and node_id not in fresh]
+        node_ids = [self.node_ids[row] for row in keep] + new_ids
+        if not new_ids and len(keep) == len(self.node_ids):
+            return len(embedding_dict) - len(node_ids)
+
+        matrices = [self.matrix[keep]] if keep else []
+        scales = [self.scales[keep]] if keep else []
+        for start in range(0, len(new_ids), _SCORE_BLOCK_ROWS):
+            block_ids = new_ids[start:start + _SCORE_BLOCK_ROWS]
+            block_matrix, block_scales = _quantize_rows(
+                np.asarray([embedding_dict[node_id] for node_id in block_ids], dtype=np.float32)
+            )
+            matrices.append(block_matrix)
+            scales.append(block_scales)
+            for node_id in block_ids:
+                embedding_dict[node_id] = []
+
+        self.node_ids = node_ids
+        if matrices:
+            self.matrix, self.scales = np.concatenate(matrices), np.concatenate(scales)
+        else:
+            self.matrix, self.scales = np.empty((0, 0), dtype=np.int8), np.empty(0, dtype=np.float32)
+        return len(embedding_dict) - len(node_ids)
+
+    def save(self, path: str):
+        """Write the rows to path atomically"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, node_ids=np.array(self.node_ids, dtype=str), matrix=self.matrix, scales=self.scales)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "QuantizedEmbeddings":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['node_ids'].tolist(), data['matrix'], data['scales'])
+
+
+class QuantizedVectorRetriever(BaseRetriever):
+    """Cosine top-k retriever over QuantizedEmbeddings, scored in integer arithmetic,
+    optionally restricted to nodes whose metadata matches a filter."""
+
+    def __init__(
+        self,
+        index: VectorStoreIndex,
+        embeddings: QuantizedEmbeddings,
+        similarity_top_k: int,
+        embed_model: Optional[BaseEmbedding] = None,
+    ):
+        super().__init__()
+        self._docstore = index.docstore
+        self._similarity_top_k = similarity_top_k
+        self._embed_model = embed_model or Settings.embed_model
+
+        self._node_ids = embeddings.node_ids
+        self._matrix, self._scales = embeddings.matrix, embeddings.scales
+
+        # Metadata per row, for pre-filtering; None rows means no filter
+        self._row_metadata = [self._docstore.get_node(node_id).metadata for node_id in self._node_ids]
+        self._rows: Optional[np.ndarray] = None
+
+    def with_filters(self, filters: Dict[str, str]) -> "QuantizedVectorRetriever":
+        """Return a retriever sharing this one's matrix, searching only nodes whose
+        metadata equals every key/value in filters"""
+        filtered = copy.copy(self)
+        filtered._rows = np.array(
+            [i for i, metadata in enumerate(self._row_metadata)
+             if all(metadata.get(key) == value for key, value in filters.items())],
+            dtype=np.int64
+        )
+        return filtered
+
+    @staticmethod
+    def _score(matrix: np.ndarray, scales: np.ndarray, query_embedding: List[float]) -> np.ndarray:
+        """Cosine scores: the query is quantized to int8 too and dot products accumulate in int32"""
+        query, query_scale = _quantize_rows(np.asarray([query_embedding], dtype=np.float32))
+        query = query[0]
+
+        scores = np.empty(len(matrix), dtype=np.int32)
+        for start in range(0, len(matrix), _SCORE_BLOCK_ROWS):
+            block = matrix[start:start + _SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = np.matmul(block, query, dtype=np.int32)
+        return scores * (scales * query_scale[0])
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        rows = self._rows
+        if rows is None:
+            matrix, scales = self._matrix, self._scales
+        else:
+            matrix, scales = self._matrix[rows], self._scales[rows]
+
+        if not len(matrix):
+            return []
+
+        query_embedding = query_bundle.embedding
+        if query_embedding is None:
+            query_embedding = self._embed_model.get_query_embedding(query_bundle.query_str)
+
+        scores = self._score(matrix, scales, query_embedding)
+
+        # Select the top k in O(N) and sort only those, instead of sorting every score
+        k = min(self._similarity_top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        node_rows = top if rows is None else rows[top]
+
+        return [
+            NodeWithScore(node=self._docstore.get_node(self._node_ids[row]), score=float(scores[i]))
+            for i, row in zip(top, node_rows)
+        ]
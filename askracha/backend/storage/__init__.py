@@ -1,3 +1,5 @@
 from .pinecone_vector_store import PineconeVectorStore
+from .page_cache import PageCache
+from .embedding_cache import EmbeddingCache
 
-__all__ = ["PineconeVectorStore"]
+__all__ = ["PineconeVectorStore", "PageCache", "EmbeddingCache"]
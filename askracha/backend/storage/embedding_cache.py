@@ -0,0 +1,64 @@
+from array import array
+from typing import List, Optional
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class EmbeddingCache:
+    """On-disk SQLite cache of query and document embeddings keyed by SHA-256 of model name and text."""
+
+    def __init__(self, path: str = os.path.join("persistent_index", "embeddings.sqlite3"),
+                 max_age_seconds: int = 30 * 24 * 3600):
+        """Open (or create) the cache database and set the entry lifetime."""
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, embedding BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def key(model_name: str, text: str) -> str:
+        """Build the cache key, so switching models never returns another model's vectors."""
+        return hashlib.sha256(f"{model_name}:{text}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        """Get the cached embedding for a key, or None if missing or expired."""
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT embedding, created_at FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Warning: Could not read embedding cache: {e}")
+            return None
+
+        if row is None or time.time() - row[1] > self.max_age_seconds:
+            return None
+        return array("f", row[0]).tolist()
+
+    def put(self, key: str, embedding: List[float]):
+        """Store an embedding (as float32) under a key."""
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, embedding, created_at) VALUES (?, ?, ?)",
+                    (key, array("f", embedding).tobytes(), time.time())
+                )
+                self._conn.commit()
+        except sqlite3.Error as e:
+            print(f"Warning: Could not cache embedding: {e}")
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
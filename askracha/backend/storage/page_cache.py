@@ -0,0 +1,62 @@
+from typing import Dict, Optional
+import os
+import json
+import time
+import hashlib
+
+
+class PageCache:
+    """On-disk cache of cleaned page text and title keyed by URL, with HTTP validators for conditional requests."""
+
+    def __init__(self, cache_dir: str = "scrape_cache", max_age_seconds: int = 7 * 24 * 3600):
+        """Initialize the cache directory and entry lifetime."""
+        self.cache_dir = cache_dir
+        self.max_age_seconds = max_age_seconds
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        """Map a URL to a filesystem-safe cache path."""
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, url: str) -> Optional[Dict]:
+        """Get the cached entry for a URL, or None if missing or expired."""
+        path = self._path(url)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry.get("fetched_at", 0) > self.max_age_seconds:
+            return None
+        return entry
+
+    def put(self, url: str, text: str, etag: Optional[str] = None, last_modified: Optional[str] = None,
+            title: Optional[str] = None):
+        """Store cleaned text and title for a URL along with its validators."""
+        entry = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "text": text,
+            "title": title,
+            "fetched_at": time.time()
+        }
+        path = self._path(url)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: Could not cache page {url}: {e}")
+
+    @staticmethod
+    def conditional_headers(entry: Dict) -> Dict[str, str]:
+        """Build If-None-Match / If-Modified-Since headers from a cached entry."""
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
@@ -1,19 +1,58 @@
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional, Tuple
 import os
+import asyncio
+import json
 import hashlib
 from datetime import datetime
+from functools import lru_cache
+from itertools import islice
 from pinecone import Pinecone, ServerlessSpec
 from llama_index.core import Document
 from llama_index.embeddings.gemini import GeminiEmbedding
+from .embedding_cache import EmbeddingCache
 import uuid
 import time
 
+# Namespace holding past question embeddings and their answers, kept apart from documents
+QA_CACHE_NAMESPACE = "askracha-qa-cache"
+
+# Content hashes looked up per metadata-filtered query when deduplicating
+_HASH_LOOKUP_CHUNK = 1000
+
+# Embedding batch requests in flight at once in aupsert_documents
+_EMBED_CONCURRENCY = 4
+
+# Pinecone caps metadata at 40 KB per vector; stored page text is kept under this many UTF-8 bytes
+_METADATA_TEXT_BYTES = 30000
+
+
+@lru_cache(maxsize=8192)
+def _content_hash(source: str, head: str) -> str:
+    """Hash a document's source and leading text, memoized since re-ingests repeat chunks."""
+    content = f"{source}:{head}"
+    # BLAKE2b is faster than MD5 on 64-bit CPUs; same 128-bit digest as rag.py's text hashes
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _truncate_utf8(text: str, max_bytes: int) -> str:
+    """Cut text to at most max_bytes of UTF-8 without splitting a character."""
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode("utf-8", "ignore")
+
 
 class PineconeVectorStore:
     """Vector database interface for storing and querying document embeddings using Pinecone."""
 
-    def __init__(self):
-        """Initialize Pinecone vector store with API key and environment."""
+    def __init__(self, pool_threads: int = 30, batch_size: int = 100,
+                 embedding_cache: Optional[EmbeddingCache] = None):
+        """
+        Initialize Pinecone vector store with API key and environment.
+        pool_threads sets how many upsert batches are in flight at once;
+        batch_size is the number of vectors per upsert request; document
+        embeddings are reused from embedding_cache when one is given.
+        """
         self.api_key = os.getenv("PINECONE_API_KEY")
         if not self.api_key:
             raise ValueError("PINECONE_API_KEY not found in environment variables")
@@ -30,21 +69,24 @@ class PineconeVectorStore:
         if gemini_api_key:
             self._embed_model = GeminiEmbedding(
                 model_name="models/text-embedding-004", 
-                api_key=gemini_api_key
+                api_key=gemini_api_key,
+                embed_batch_size=int(os.getenv("EMBED_BATCH_SIZE", "100"))  # Gemini allows up to 100
             )
         else:
             self._embed_model = None
 
+        # Upsert batching (Pinecone recommends batches of 100)
+        self.batch_size = batch_size
+        self._embedding_cache = embedding_cache
+
         # Connect to or create index
         self._ensure_index_exists()
-        self.index = self.pc.Index(self.index_name)
+        self.index = self.pc.Index(self.index_name, pool_threads=pool_threads)
 
     def _ensure_index_exists(self):
         """Create Pinecone index if it doesn't exist."""
         try:
-            existing_indexes = [idx.name for idx in self.pc.list_indexes()]
-            
-            if self.index_name not in existing_indexes:
+            if not self.pc.has_index(self.index_name):
                 print(f"Creating Pinecone index: {self.index_name}")
                 self.pc.create_index(
                     name=self.index_name,
@@ -67,26 +109,92 @@ class PineconeVectorStore:
 
     def _generate_content_hash(self, text: str, source: str) -> str:
         """Generate a unique hash for document content and source."""
-        content = f"{source}:{text[:1000]}"  # Using first 1000 chars + source
-        return hashlib.md5(content.encode("utf-8")).hexdigest()
+        return _content_hash(source, text[:1000])  # Using first 1000 chars + source
+
+    def _find_existing_documents(self, content_hashes: List[str]) -> Dict[str, str]:
+        """Map content hashes that already exist in the index to their vector IDs."""
+        existing = {}
+        unique_hashes = list(dict.fromkeys(content_hashes))
+        # One metadata-filtered query per chunk of hashes instead of one per document
+        for i in range(0, len(unique_hashes), _HASH_LOOKUP_CHUNK):
+            chunk = unique_hashes[i:i + _HASH_LOOKUP_CHUNK]
+            try:
+                results = self.index.query(
+                    vector=[0.0] * self.dimension,  # Dummy vector for metadata-only query
+                    filter={"content_hash": {"$in": chunk}},
+                    top_k=len(chunk),
+                    include_metadata=True
+                )
+            except Exception as e:
+                print(f"Error finding existing documents: {e}")
+                continue
+
+            for match in results.matches:
+                content_hash = (match.metadata or {}).get("content_hash")
+                if content_hash:
+                    existing.setdefault(content_hash, match.id)
+        return existing
+
+    def _apply_cached_embeddings(self, documents: List[Document]) -> List[Tuple[Document, Optional[str]]]:
+        """Set cached embeddings on documents; return the rest with their cache keys."""
+        cache = self._embedding_cache
+        if cache is None:
+            return [(doc, None) for doc in documents]
+
+        # Reuse embeddings of texts seen before, even in a previous run
+        model_key = f"{self._embed_model.model_name}:document"
+        uncached = []
+        for doc in documents:
+            key = EmbeddingCache.key(model_key, doc.text)
+            doc.embedding = cache.get(key)
+            if doc.embedding is None:
+                uncached.append((doc, key))
+        return uncached
+
+    def _cache_embeddings(self, embedded: List[Tuple[Document, Optional[str]]]):
+        """Store freshly generated document embeddings in the embedding cache."""
+        if self._embedding_cache is not None:
+            for doc, key in embedded:
+                self._embedding_cache.put(key, doc.embedding)
+
+    def _embed_documents(self, documents: List[Document]):
+        """Set embeddings on documents, batched up to the model's embed_batch_size per request."""
+        uncached = self._apply_cached_embeddings(documents)
+        if not uncached:
+            return
+        documents = [doc for doc, _ in uncached]
 
-    def _find_existing_document(self, content_hash: str) -> Optional[str]:
-        """Find existing document by content hash using metadata filtering."""
         try:
-            # Query with metadata filter
-            results = self.index.query(
-                vector=[0.0] * self.dimension,  # Dummy vector for metadata-only query
-                filter={"content_hash": {"$eq": content_hash}},
-                top_k=1,
-                include_metadata=True
+            embeddings = self._embed_model.get_text_embedding_batch(
+                [doc.text for doc in documents], show_progress=False
             )
-            
-            if results.matches and len(results.matches) > 0:
-                return results.matches[0].id
-            return None
         except Exception as e:
-            print(f"Error finding existing document: {e}")
-            return None
+            # Fall back to one request per document, so one bad batch doesn't sink the rest
+            print(f"Warning: Batch embedding failed, embedding documents one by one: {e}")
+            embeddings = [self._embed_model.get_text_embedding(doc.text) for doc in documents]
+
+        for doc, embedding in zip(documents, embeddings):
+            doc.embedding = embedding
+        self._cache_embeddings(uncached)
+
+    async def _aembed_documents(self, documents: List[Document]):
+        """Async _embed_documents."""
+        uncached = self._apply_cached_embeddings(documents)
+        if not uncached:
+            return
+        documents = [doc for doc, _ in uncached]
+
+        try:
+            embeddings = await self._embed_model.aget_text_embedding_batch(
+                [doc.text for doc in documents], show_progress=False
+            )
+        except Exception as e:
+            print(f"Warning: Batch embedding failed, embedding documents one by one: {e}")
+            embeddings = [await self._embed_model.aget_text_embedding(doc.text) for doc in documents]
+
+        for doc, embedding in zip(documents, embeddings):
+            doc.embedding = embedding
+        self._cache_embeddings(uncached)
 
     def initialize_index(self) -> Dict:
         """Initialize/verify the Pinecone index."""
@@ -102,89 +210,166 @@ class PineconeVectorStore:
                 "message": f"Error initializing index: {str(e)}"
             }
 
+    def _find_new_documents(self, documents: List[Document], current_time: int):
+        """
+        Deduplicate documents against the index, refreshing the timestamp of ones
+        already stored. Returns every document's vector ID, the new documents as
+        (document, vector ID, content hash) tuples, and the number of duplicates.
+        """
+        content_hashes = [
+            self._generate_content_hash(doc.text, doc.metadata.get("source", "unknown"))
+            for doc in documents
+        ]
+        existing_ids = self._find_existing_documents(content_hashes)
+
+        vector_ids = []
+        new_docs = []
+        duplicates_found = 0
+        for doc, content_hash in zip(documents, content_hashes):
+            # Check for existing document
+            existing_id = existing_ids.get(content_hash)
+
+            if existing_id:
+                duplicates_found += 1
+                vector_ids.append(existing_id)
+                
+                # Update timestamp for existing document
+                try:
+                    self.index.update(
+                        id=existing_id,
+                        set_metadata={"timestamp": current_time}
+                    )
+                except Exception as e:
+                    print(f"Warning: Failed to update timestamp for {existing_id}: {e}")
+                
+                continue
+
+            vector_id = doc.doc_id or str(uuid.uuid4())
+            vector_ids.append(vector_id)
+            new_docs.append((doc, vector_id, content_hash))
+
+        return vector_ids, new_docs, duplicates_found
+
+    def _submit_upsert(self, batch: List[Tuple[Document, str, str]], current_time: int):
+        """Start upserting a batch of embedded new documents on the index's thread pool."""
+        vectors = []
+        for doc, vector_id, content_hash in batch:
+            # Prepare metadata for Pinecone
+            metadata = {
+                **doc.metadata,
+                "timestamp": current_time,
+                # Whole page text, so the page can be re-chunked from the store alone
+                "text": _truncate_utf8(doc.text, _METADATA_TEXT_BYTES),
+                "content_hash": content_hash
+            }
+
+            vectors.append({
+                "id": vector_id,
+                "values": doc.embedding,
+                "metadata": metadata
+            })
+        return self.index.upsert(vectors=vectors, async_req=True)
+
+    @staticmethod
+    def _join_upserts(pending: List) -> None:
+        """Wait for submitted upserts, raising the first failure."""
+        for async_result in pending:
+            async_result.get()
+        if pending:
+            print(f"Upserted {len(pending)} batches")
+
+    @staticmethod
+    def _upsert_summary(documents: List[Document], vector_ids: List[str], new_documents: int,
+                        duplicates_found: int) -> Dict:
+        """Build the result of a successful upsert."""
+        return {
+            "success": True,
+            "message": f"Successfully processed {len(documents)} documents",
+            "new_documents": new_documents,
+            "duplicates_found": duplicates_found,
+            "count": len(vector_ids),
+            "ids": vector_ids
+        }
+
     def upsert_documents(self, documents: List[Document]) -> Dict:
         """Insert or update documents with deduplication."""
         try:
-            current_time = int(datetime.now().timestamp())
-            vectors_to_upsert = []
-            vector_ids = []
-            duplicates_found = 0
-            new_documents = 0
-
             if not self._embed_model:
                 return {
                     "success": False,
                     "message": "GEMINI_API_KEY not found for embeddings"
                 }
 
-            for doc in documents:
-                source = doc.metadata.get("source", "unknown")
-                content_hash = self._generate_content_hash(doc.text, source)
-
-                # Check for existing document
-                existing_id = self._find_existing_document(content_hash)
-
-                if existing_id:
-                    duplicates_found += 1
-                    vector_ids.append(existing_id)
-                    
-                    # Update timestamp for existing document
-                    try:
-                        self.index.update(
-                            id=existing_id,
-                            set_metadata={"timestamp": current_time}
-                        )
-                    except Exception as e:
-                        print(f"Warning: Failed to update timestamp for {existing_id}: {e}")
-                    
-                    continue
-
-                new_documents += 1
-                vector_id = doc.doc_id or str(uuid.uuid4())
-                vector_ids.append(vector_id)
+            current_time = int(datetime.now().timestamp())
+            vector_ids, new_docs, duplicates_found = self._find_new_documents(documents, current_time)
 
-                # Generate embedding if not present
-                if not hasattr(doc, "embedding") or doc.embedding is None:
+            # Embed a batch at a time (one request per batch rather than per document),
+            # upserting each batch in the background while the next one embeds
+            pending = []
+            for i in range(0, len(new_docs), self.batch_size):
+                batch = new_docs[i:i + self.batch_size]
+                to_embed = [doc for doc, _, _ in batch if getattr(doc, "embedding", None) is None]
+                if to_embed:
                     try:
-                        embedding = self._embed_model.get_text_embedding(doc.text)
-                        doc.embedding = embedding
+                        self._embed_documents(to_embed)
                     except Exception as e:
+                        self._join_upserts(pending)
                         return {
                             "success": False,
                             "message": f"Error generating embedding: {str(e)}"
                         }
+                pending.append(self._submit_upsert(batch, current_time))
 
-                # Prepare metadata for Pinecone
-                metadata = {
-                    **doc.metadata,
-                    "timestamp": current_time,
-                    "text": doc.text[:1000],  # Store first 1000 chars in metadata
-                    "content_hash": content_hash
+            self._join_upserts(pending)
+            return self._upsert_summary(documents, vector_ids, len(new_docs), duplicates_found)
+        except Exception as e:
+            return {
+                "success": False,
+                "message": f"Error upserting documents: {str(e)}"
+            }
+
+    async def aupsert_documents(self, documents: List[Document]) -> Dict:
+        """
+        Async upsert_documents: embedding batches are requested concurrently on the
+        event loop, while the blocking Pinecone calls run on worker threads.
+        """
+        try:
+            if not self._embed_model:
+                return {
+                    "success": False,
+                    "message": "GEMINI_API_KEY not found for embeddings"
                 }
 
-                vectors_to_upsert.append({
-                    "id": vector_id,
-                    "values": doc.embedding,
-                    "metadata": metadata
-                })
-
-            # Batch upsert to Pinecone
-            if vectors_to_upsert:
-                # Pinecone recommends batches of 100
-                batch_size = 100
-                for i in range(0, len(vectors_to_upsert), batch_size):
-                    batch = vectors_to_upsert[i:i + batch_size]
-                    self.index.upsert(vectors=batch)
-                    print(f"Upserted batch {i//batch_size + 1} ({len(batch)} vectors)")
+            current_time = int(datetime.now().timestamp())
+            vector_ids, new_docs, duplicates_found = await asyncio.to_thread(
+                self._find_new_documents, documents, current_time
+            )
 
-            return {
-                "success": True,
-                "message": f"Successfully processed {len(documents)} documents",
-                "new_documents": new_documents,
-                "duplicates_found": duplicates_found,
-                "count": len(vector_ids),
-                "ids": vector_ids
-            }
+            # Embed up to _EMBED_CONCURRENCY batches at once, each upserted as soon as it's embedded
+            pending = []
+            semaphore = asyncio.Semaphore(_EMBED_CONCURRENCY)
+
+            async def embed_and_submit(batch: List[Tuple[Document, str, str]]):
+                to_embed = [doc for doc, _, _ in batch if getattr(doc, "embedding", None) is None]
+                if to_embed:
+                    async with semaphore:
+                        await self._aembed_documents(to_embed)
+                pending.append(self._submit_upsert(batch, current_time))
+
+            results = await asyncio.gather(
+                *(embed_and_submit(new_docs[i:i + self.batch_size])
+                  for i in range(0, len(new_docs), self.batch_size)),
+                return_exceptions=True
+            )
+            await asyncio.to_thread(self._join_upserts, pending)
+
+            error = next((result for result in results if isinstance(result, Exception)), None)
+            if error is not None:
+                return {
+                    "success": False,
+                    "message": f"Error generating embedding: {str(error)}"
+                }
+            return self._upsert_summary(documents, vector_ids, len(new_docs), duplicates_found)
         except Exception as e:
             return {
                 "success": False,
@@ -226,6 +411,9 @@ class PineconeVectorStore:
         """Get index statistics."""
         try:
             stats = self.index.describe_index_stats()
+            # Cached answers live in their own namespace and aren't documents
+            qa_cache = (getattr(stats, 'namespaces', None) or {}).get(QA_CACHE_NAMESPACE)
+            vectors_count = stats.total_vector_count - (qa_cache.vector_count if qa_cache else 0)
             
             return {
                 "success": True,
@@ -233,8 +421,8 @@ class PineconeVectorStore:
                     "Stats",
                     (),
                     {
-                        "vectors_count": stats.total_vector_count,
-                        "points_count": stats.total_vector_count,
+                        "vectors_count": vectors_count,
+                        "points_count": vectors_count,
                         "segments_count": len(stats.namespaces) if hasattr(stats, 'namespaces') else 1,
                         "status": "ready"
                     }
@@ -246,29 +434,96 @@ class PineconeVectorStore:
                 "message": f"Error getting stats: {str(e)}"
             }
 
-    def get_all_vectors(self, limit: int = 1000) -> List[Dict]:
-        """
-        Retrieve all vectors from the index (for migration/inspection).
-        Note: Pinecone doesn't have a direct 'scroll' like Qdrant, 
-        so this uses query with a dummy vector.
+    def find_cached_answer(self, embedding: List[float], corpus_version: str, min_score: float = 0.95,
+                           max_age_seconds: int = 7 * 24 * 3600) -> Optional[Dict]:
+        """Find the cached answer to the most similar past question, if similar and recent enough.
+
+        Only answers cached for the same corpus_version (the documents they were generated from) match.
         """
         try:
-            # Query with dummy vector to get all results
             results = self.index.query(
-                vector=[0.0] * self.dimension,
-                top_k=limit,
+                vector=embedding,
+                top_k=1,
+                namespace=QA_CACHE_NAMESPACE,
+                filter={"corpus_version": {"$eq": corpus_version}},
                 include_metadata=True
             )
-            
-            vectors = []
-            for match in results.matches:
-                vectors.append({
-                    "id": match.id,
-                    "metadata": match.metadata,
-                    "score": match.score
-                })
-            
-            return vectors
+        except Exception as e:
+            print(f"Error querying answer cache: {e}")
+            return None
+
+        if not results.matches:
+            return None
+        match = results.matches[0]
+        metadata = match.metadata or {}
+        if match.score < min_score or time.time() - metadata.get("ts", 0) > max_age_seconds:
+            return None
+
+        return {
+            "success": True,
+            "answer": metadata.get("answer", ""),
+            "sources": json.loads(metadata.get("sources", "[]")),
+            "model_used": metadata.get("model_used")
+        }
+
+    def cache_answer(self, embedding: List[float], question: str, result: Dict, corpus_version: str):
+        """Store a question embedding with its answer and sources in the answer cache."""
+        try:
+            self.index.upsert(
+                vectors=[{
+                    "id": str(uuid.uuid4()),
+                    "values": embedding,
+                    "metadata": {
+                        "question": question,
+                        "answer": result["answer"],
+                        # Metadata values must be flat, so sources are stored as JSON
+                        "sources": json.dumps(result["sources"]),
+                        "model_used": result.get("model_used") or "",
+                        "corpus_version": corpus_version,
+                        "ts": time.time()
+                    }
+                }],
+                namespace=QA_CACHE_NAMESPACE
+            )
+        except Exception as e:
+            print(f"Error caching answer: {e}")
+
+    def clear_cached_answers(self):
+        """Drop every cached answer, e.g. after the documents they were generated from change."""
+        try:
+            self.index.delete(delete_all=True, namespace=QA_CACHE_NAMESPACE)
+        except Exception as e:
+            # Deleting from a namespace that doesn't exist yet fails; there is nothing to clear
+            print(f"Warning: Could not clear answer cache: {e}")
+
+    def iter_vectors(self, batch_size: int = 100) -> Iterator[Dict]:
+        """
+        Stream every vector in the index, one page of IDs at a time.
+        Pages through IDs with list() and loads each page with fetch(), so
+        memory stays bounded and results aren't capped by a query's top_k.
+        """
+        for ids in self.index.list(limit=batch_size):
+            if not ids:
+                continue
+            response = self.index.fetch(ids=ids)
+            for vector_id, vector in response.vectors.items():
+                yield {
+                    "id": vector_id,
+                    "values": vector.values,
+                    "metadata": vector.metadata or {}
+                }
+
+    def get_all_vectors(self, limit: int = 1000) -> List[Dict]:
+        """
+        Retrieve all vectors from the index (for migration/inspection), up to limit.
+        Lists IDs and fetches them rather than querying with a dummy vector, which
+        would only return that vector's nearest neighbours.
+        """
+        try:
+            return [
+                {"id": vector["id"], "metadata": vector["metadata"]}
+                for vector in islice(self.iter_vectors(batch_size=min(100, limit)), limit)
+            ]
         except Exception as e:
             print(f"Error retrieving vectors: {e}")
             return []
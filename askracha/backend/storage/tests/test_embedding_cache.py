@@ -0,0 +1,50 @@
+import pytest
+
+from storage.embedding_cache import EmbeddingCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    yield cache
+    cache.close()
+
+
+def test_round_trips_embedding_as_float32(cache):
+    key = EmbeddingCache.key("text-embedding-004", "hello")
+    cache.put(key, [0.5, -1.25, 3.0])
+
+    assert cache.get(key) == [0.5, -1.25, 3.0]
+
+
+def test_missing_key_returns_none(cache):
+    assert cache.get(EmbeddingCache.key("text-embedding-004", "never stored")) is None
+
+
+def test_key_depends_on_model_and_text():
+    key = EmbeddingCache.key("text-embedding-004", "hello")
+
+    assert key == EmbeddingCache.key("text-embedding-004", "hello")
+    assert key != EmbeddingCache.key("other-model", "hello")
+    assert key != EmbeddingCache.key("text-embedding-004", "hello!")
+
+
+def test_expired_entry_returns_none(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"), max_age_seconds=-1)
+    key = EmbeddingCache.key("text-embedding-004", "hello")
+    cache.put(key, [1.0])
+
+    assert cache.get(key) is None
+    cache.close()
+
+
+def test_entries_survive_reopening(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    key = EmbeddingCache.key("text-embedding-004", "hello")
+    cache = EmbeddingCache(path)
+    cache.put(key, [1.0, 2.0])
+    cache.close()
+
+    reopened = EmbeddingCache(path)
+    assert reopened.get(key) == [1.0, 2.0]
+    reopened.close()
@@ -0,0 +1,75 @@
+import pytest
+
+pytest.importorskip("redis")
+
+from rate_limit import rate_limiter
+from rate_limit.rate_limiter import LocalRateLimiter, RateLimitConfig
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    return clock
+
+
+def test_denies_until_a_token_refills(clock):
+    limiter = LocalRateLimiter(RateLimitConfig(default_limit_seconds=60, backend="local"))
+
+    assert limiter.check_rate_limit("web:alice").allowed
+
+    clock.now += 30
+    denied = limiter.check_rate_limit("web:alice")
+    assert not denied.allowed
+    assert denied.remaining_seconds == 30
+
+    clock.now += 30
+    assert limiter.check_rate_limit("web:alice").allowed
+
+
+def test_burst_capacity_refills_at_configured_rate(clock):
+    limiter = LocalRateLimiter(RateLimitConfig(capacity=3, refill_rate=0.5, backend="local"))
+
+    assert [limiter.check_rate_limit("web:bob").allowed for _ in range(4)] == [True, True, True, False]
+
+    # One token every two seconds, never more than capacity
+    clock.now += 2
+    assert limiter.check_rate_limit("web:bob").allowed
+    assert not limiter.check_rate_limit("web:bob").allowed
+
+    clock.now += 3600
+    assert [limiter.check_rate_limit("web:bob").allowed for _ in range(4)] == [True, True, True, False]
+
+
+def test_users_have_separate_buckets(clock):
+    limiter = LocalRateLimiter(RateLimitConfig(backend="local"))
+
+    assert limiter.check_rate_limit("web:alice").allowed
+    assert limiter.check_rate_limit("web:bob").allowed
+    assert not limiter.check_rate_limit("web:alice").allowed
+
+
+def test_reset_restores_the_bucket(clock):
+    limiter = LocalRateLimiter(RateLimitConfig(backend="local"))
+    limiter.check_rate_limit("web:alice")
+
+    assert limiter.reset_user_rate_limit("web:alice")
+    assert limiter.check_rate_limit("web:alice").allowed
+
+
+def test_eviction_keeps_buckets_still_refilling(clock):
+    # One bucket per shard, so every new user overflows a shard
+    limiter = LocalRateLimiter(RateLimitConfig(backend="local"), max_entries=64)
+    users = [f"web:user{i}" for i in range(500)]
+    for user_id in users:
+        limiter.check_rate_limit(user_id)
+
+    assert not any(limiter.check_rate_limit(user_id).allowed for user_id in users)
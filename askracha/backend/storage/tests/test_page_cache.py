@@ -0,0 +1,35 @@
+from storage.page_cache import PageCache
+
+
+def test_round_trips_text_title_and_validators(tmp_path):
+    cache = PageCache(str(tmp_path))
+    cache.put("https://docs.storacha.network/quickstart/", "Quickstart text",
+              etag='"abc"', last_modified="Wed, 01 Jan 2025 00:00:00 GMT", title="Quickstart")
+
+    entry = cache.get("https://docs.storacha.network/quickstart/")
+
+    assert entry["text"] == "Quickstart text"
+    assert entry["title"] == "Quickstart"
+    assert entry["etag"] == '"abc"'
+    assert entry["last_modified"] == "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+def test_missing_url_returns_none(tmp_path):
+    assert PageCache(str(tmp_path)).get("https://example.com/") is None
+
+
+def test_expired_entry_returns_none(tmp_path):
+    cache = PageCache(str(tmp_path), max_age_seconds=-1)
+    cache.put("https://example.com/", "text")
+
+    assert cache.get("https://example.com/") is None
+
+
+def test_conditional_headers_only_include_known_validators():
+    assert PageCache.conditional_headers({"etag": '"abc"', "last_modified": None}) == {
+        "If-None-Match": '"abc"'
+    }
+    assert PageCache.conditional_headers({"etag": None, "last_modified": "yesterday"}) == {
+        "If-Modified-Since": "yesterday"
+    }
+    assert PageCache.conditional_headers({}) == {}
@@ -0,0 +1,89 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from query_cache import QueryCache, normalize_question
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = QueryCache(str(tmp_path / "qcache.pkl"), flush_interval=3600)
+    yield cache
+    cache.close()
+
+
+def test_normalize_question_ignores_case_and_whitespace():
+    assert normalize_question("  What is  UCAN?\n") == normalize_question("what is ucan?")
+
+
+def test_exact_hit_returns_a_copy(cache):
+    cache.put("what is ucan?", {"answer": "A capability token"})
+
+    hit = cache.get_exact("what is ucan?")
+    hit["answer"] = "changed"
+
+    assert cache.get_exact("what is ucan?") == {"answer": "A capability token"}
+    assert cache.get_exact("something else") is None
+
+
+def test_semantic_hit_above_threshold_only(cache):
+    cache.put("what is ucan?", {"answer": "A capability token"}, embedding=[1.0, 0.0, 0.0])
+
+    # Scaled copies have cosine similarity 1; orthogonal questions have 0
+    assert cache.get_similar([2.0, 0.0, 0.0]) == {"answer": "A capability token"}
+    assert cache.get_similar([0.99, 0.05, 0.0]) == {"answer": "A capability token"}
+    assert cache.get_similar([0.0, 1.0, 0.0]) is None
+
+
+def test_semantic_hit_picks_most_similar(cache):
+    cache.put("a", {"answer": "a"}, embedding=[1.0, 0.0])
+    cache.put("b", {"answer": "b"}, embedding=[0.0, 1.0])
+
+    assert cache.get_similar([0.5, 1.0]) is None
+    assert cache.get_similar([0.01, 1.0]) == {"answer": "b"}
+
+
+def test_exact_entries_evict_least_recently_used(tmp_path):
+    cache = QueryCache(str(tmp_path / "qcache.pkl"), max_entries=2, flush_interval=3600)
+    cache.put("a", {"answer": "a"})
+    cache.put("b", {"answer": "b"})
+    cache.get_exact("a")
+    cache.put("c", {"answer": "c"})
+
+    assert cache.get_exact("b") is None
+    assert cache.get_exact("a") == {"answer": "a"}
+    cache.close()
+
+
+def test_clear_drops_both_tiers(cache):
+    cache.put("a", {"answer": "a"}, embedding=[1.0, 0.0])
+    cache.clear()
+
+    assert cache.get_exact("a") is None
+    assert cache.get_similar([1.0, 0.0]) is None
+
+
+def test_close_persists_entries(tmp_path):
+    path = str(tmp_path / "qcache.pkl")
+    cache = QueryCache(path, flush_interval=3600)
+    cache.put("a", {"answer": "a"}, embedding=[1.0, 0.0])
+    cache.close()
+
+    reopened = QueryCache(path, flush_interval=3600)
+    assert reopened.get_exact("a") == {"answer": "a"}
+    assert reopened.get_similar([1.0, 0.0]) == {"answer": "a"}
+    reopened.close()
+
+
+def test_snapshot_from_before_clear_is_not_written(tmp_path):
+    path = str(tmp_path / "qcache.pkl")
+    cache = QueryCache(path, flush_interval=3600)
+    cache.put("a", {"answer": "a"})
+    stale = ({"a": {"answer": "a"}}, None, [])
+    generation = cache._generation
+
+    cache.clear()
+    cache._save(stale, generation)
+    cache.close()
+
+    assert QueryCache(path, flush_interval=3600).get_exact("a") is None
@@ -0,0 +1,95 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("llama_index.core")
+
+from llama_index.core import VectorStoreIndex
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import QueryBundle, TextNode
+
+from retrieval import QuantizedEmbeddings, QuantizedVectorRetriever
+
+
+def _build(count: int = 200, dimension: int = 64, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(count, dimension))
+    nodes = [
+        TextNode(id_=f"node{i}", text=f"chunk {i}", embedding=vectors[i].tolist(),
+                 metadata={"doc_type": "docs" if i % 2 else "blog"})
+        for i in range(count)
+    ]
+    # Nodes and queries carry their embeddings, so the embed model is never called
+    index = VectorStoreIndex(nodes, embed_model=MockEmbedding(embed_dim=dimension))
+    embeddings = QuantizedEmbeddings()
+    embeddings.sync(index.vector_store.data.embedding_dict)
+    return index, embeddings, vectors, rng
+
+
+def _float_scores(vectors, query):
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return unit @ (query / np.linalg.norm(query))
+
+
+def _assert_matches_baseline(results, scores, rows, k=5):
+    """Each rank's true cosine score matches the float baseline's; int8 rounding (well under
+    0.01 here) may only swap near ties"""
+    retrieved = [int(result.node.node_id[len("node"):]) for result in results]
+    baseline = sorted(rows, key=lambda row: -scores[row])[:k]
+
+    assert len(retrieved) == k
+    assert set(retrieved) <= set(rows)
+    assert np.allclose(scores[retrieved], scores[baseline], atol=0.01)
+    reported = [result.score for result in results]
+    assert reported == sorted(reported, reverse=True)
+    assert np.allclose(reported, scores[retrieved], atol=0.01)
+
+
+def test_top_k_matches_float_baseline():
+    index, embeddings, vectors, rng = _build()
+    retriever = QuantizedVectorRetriever(index, embeddings, similarity_top_k=5,
+                                         embed_model=MockEmbedding(embed_dim=vectors.shape[1]))
+
+    for _ in range(10):
+        query = rng.normal(size=vectors.shape[1])
+        results = retriever.retrieve(QueryBundle("q", embedding=query.tolist()))
+
+        _assert_matches_baseline(results, _float_scores(vectors, query), range(len(vectors)))
+
+
+def test_filters_restrict_candidates():
+    index, embeddings, vectors, rng = _build()
+    retriever = QuantizedVectorRetriever(index, embeddings, similarity_top_k=5,
+                                         embed_model=MockEmbedding(embed_dim=vectors.shape[1]))
+    query = rng.normal(size=vectors.shape[1])
+
+    results = retriever.with_filters({"doc_type": "docs"}).retrieve(QueryBundle("q", embedding=query.tolist()))
+
+    _assert_matches_baseline(results, _float_scores(vectors, query), range(1, len(vectors), 2))
+
+
+def test_sync_moves_floats_into_int8_rows():
+    index, embeddings, vectors, _ = _build(count=10)
+    embedding_dict = index.vector_store.data.embedding_dict
+
+    assert embeddings.matrix.dtype == np.int8
+    assert embeddings.matrix.shape == (10, vectors.shape[1])
+    assert all(embedding == [] for embedding in embedding_dict.values())
+
+    del embedding_dict["node3"]
+    embedding_dict["node10"] = vectors[0].tolist()
+    assert embeddings.sync(embedding_dict) == 0
+    assert "node3" not in embeddings.node_ids
+    assert embeddings.node_ids[-1] == "node10"
+    assert embeddings.matrix.shape == (10, vectors.shape[1])
+
+
+def test_save_and_load_round_trip(tmp_path):
+    _, embeddings, _, _ = _build(count=10)
+    path = str(tmp_path / "embeddings.q8.npz")
+    embeddings.save(path)
+
+    loaded = QuantizedEmbeddings.load(path)
+
+    assert loaded.node_ids == embeddings.node_ids
+    assert np.array_equal(loaded.matrix, embeddings.matrix)
+    assert np.array_equal(loaded.scales, embeddings.scales)